@@ -0,0 +1,71 @@
+"""Benchmark near-duplicate clustering (ctools/dedup.py) against growing histories.
+
+For every history size, a synthetic history (see fixtures.py) whose last
+--duplicates share repeats earlier flats is clustered. The run is timed, then
+repeated under tracemalloc for its peak memory, and scored: the repeats that
+joined another listing's cluster (recall), and the original listings merged
+into another one (false merges; synthetic titles are generic, so a few are
+real lookalikes).
+
+    python benchmarks/bench_dedup.py [--sizes 1000 10000 50000 100000] [--duplicates 0.05] [--json out.json]
+"""
+import argparse
+import json
+import os
+import sys
+import time
+import tracemalloc
+
+import numpy as np
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ctools import dedup  # noqa: E402
+import fixtures  # noqa: E402
+
+
+SIZES = [1_000, 10_000, 50_000, 100_000]
+
+
+def bench_size(size, duplicates):
+    history = fixtures.history(size, duplicates=duplicates)
+
+    start = time.perf_counter()
+    labels = dedup.cluster(history).to_numpy()
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    dedup.cluster(history)
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+
+    copies = int(size * duplicates)
+    rows = np.arange(size)
+    found = int((labels[size - copies:] != rows[size - copies:]).sum())
+    false_merges = int((labels[:size - copies] != rows[:size - copies]).sum())
+    print(
+        f"{size:>10,} properties {seconds * 1000:10.1f} ms {size / seconds:12,.0f} rows/s {peak / 2**20:8.1f} MiB peak"
+        f"   repeats found {found:,}/{copies:,}   false merges {false_merges:,}"
+    )
+    return {
+        "size": size, "seconds": round(seconds, 4), "peak_mib": round(peak / 2**20, 1),
+        "repeats": copies, "found": found, "false_merges": false_merges, "clusters": int(len(set(labels))),
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--duplicates", type=float, default=0.05, help="share of the history that repeats earlier flats")
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = [bench_size(size, args.duplicates) for size in args.sizes]
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
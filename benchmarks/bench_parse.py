@@ -0,0 +1,166 @@
+"""Benchmark the listing extractors over saved axius/ and inmocasal/ pages.
+
+Compares the previous extractors (BeautifulSoup with "html.parser" and lambda
+string searches) with the current ones (lxml with compiled selectors) and
+checks both give the same rows (on the columns the previous ones extracted:
+the current ones also read title, area and size). Pages are read from the old axius/ and
+inmocasal/ folders and from the page cache, plus `--synthetic` generated pages
+(see fixtures.py).
+
+    python benchmarks/bench_parse.py [--repeat 5] [--synthetic 50]
+"""
+import argparse
+import os
+import sys
+import time
+
+import pandas as pd
+from bs4 import BeautifulSoup
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ctools.clogger import logger  # noqa: E402
+import axius  # noqa: E402
+import inmocasal  # noqa: E402
+import fixtures  # noqa: E402
+
+
+# ---------------- Previous extractors, kept as the baseline
+def legacy_axius(page_source):
+    """Extract relevant data from the HTML using BeautifulSoup."""
+    try:
+        soup = BeautifulSoup(page_source, "html.parser")
+
+        # Step 1: Extract DIVs
+        div_elements = soup.select("div.mh-estate-vertical__primary")
+        div_data = []
+
+        for div in div_elements:
+            try:
+                # Extract Ref and Price tags from the div
+                ref_tag = div.find("span", string=lambda s: s and "Ref.:" in s)
+                price_tag = div.find("span", string=lambda s: s and "Precio:" in s)
+
+                ref = ref_tag.string.replace("Ref.:", "").strip() if ref_tag else None
+                price = price_tag.string.replace("Precio:", "").replace("€", "").strip() if price_tag else None
+
+                # Store the extracted data
+                if ref or price:
+                    div_data.append({"ref": ref, "price": price})
+                else:
+                    logger.info(f"Skipping div with no data: {div}")
+
+            except Exception as e:
+                logger.error(f"Error processing div {div}: {e}")
+
+        # Step 2: Extract Articles
+        articles = soup.find_all("article", id=lambda x: x and x.startswith("inmueble_"))
+        article_data_list = []
+
+        for article in articles:
+            try:
+                # Extract property code from article ID
+                property_code = article.get("id").replace("inmueble_", "").strip()
+                # Store property code for URL construction
+                article_data_list.append(f"https://arxus.es/ficha-inmueble/?cod_inmueble={property_code}")
+            except Exception as e:
+                logger.error(f"Error processing article {article}: {e}")
+
+        # Step 3: Merge DIV and Article Data
+        final_data = []
+        for idx, item in enumerate(div_data):
+            ref = item.get("ref")
+            price = item.get("price")
+
+            # Get the corresponding URL from article_data_list by index
+            property_url = article_data_list[idx] if idx < len(article_data_list) else None
+
+            if ref and property_url:
+                final_data.append({"ref": ref, "price": price, "url": property_url, "inmobiliaria": "axius"})
+            else:
+                logger.error(f"Skipping item due to missing URL: ref={ref}, price={price}")
+
+        return pd.DataFrame(final_data)
+
+    except Exception as e:
+        logger.error(f"Error parsing HTML: {e}")
+        return pd.DataFrame()
+
+
+def legacy_inmocasal(page_source):
+    """Extract relevant data from the HTML using BeautifulSoup."""
+    try:
+        soup = BeautifulSoup(page_source, "html.parser")
+
+        # Step 1: Extract DIVs
+        div_elements = soup.select("div.zt-prop-blog-minis-item")
+        div_data = []
+
+        for div in div_elements:
+            try:
+                # Extract Ref and Price tags from the div
+                ref_tag = div.find("strong", string=lambda s: s and "Ref. " in s)
+                price_tag = div.find("b")
+                
+                ref = ref_tag.string.replace("Ref. ", "").strip() if ref_tag else None
+                price = price_tag.string.replace("€", "").strip() if price_tag else None
+                url = f"https://www.inmocasal.es/propiedad/?referencia={ref}"
+
+                # Store the extracted data
+                if ref or price:
+                    div_data.append({"ref": ref, "price": price, "url": url, "inmobiliaria": "inmocasal"})
+                else:
+                    logger.info(f"Skipping div with no data: {div}")
+
+            except Exception as e:
+                logger.error(f"Error processing div {div}: {e}")
+
+        # Return the DataFrame after processing all divs
+        return pd.DataFrame(div_data)
+        
+    except Exception as e:
+        logger.error(f"Error extract_data_from_html(): {e}")
+        return pd.DataFrame()
+
+
+def time_calls(function, arguments, repeat):
+    start = time.perf_counter()
+    for _ in range(repeat):
+        results = [function(argument) for argument in arguments]
+    return (time.perf_counter() - start) / repeat, results
+
+
+def bench_site(name, legacy, current, repeat, synthetic=0):
+    sources = fixtures.saved_pages(name) + fixtures.synthetic_pages(name, synthetic)
+    if not sources:
+        print(f"{name}: no saved pages found, skipping.")
+        return
+
+    legacy_time, legacy_rows = time_calls(legacy, sources, repeat)
+    current_time, current_rows = time_calls(current, sources, repeat)
+
+    mismatches = sum(
+        not old.reset_index(drop=True).equals(new.reindex(columns=old.columns).reset_index(drop=True))
+        for old, new in zip(legacy_rows, current_rows)
+    )
+    rows = sum(len(frame) for frame in current_rows)
+    print(
+        f"{name}: {len(sources)} pages, {rows} rows | "
+        f"bs4/html.parser {legacy_time * 1000:.1f} ms | lxml {current_time * 1000:.1f} ms | "
+        f"x{legacy_time / current_time:.1f} | pages with different rows: {mismatches}"
+    )
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--repeat", type=int, default=5)
+    parser.add_argument("--synthetic", type=int, default=0, help="generated pages added to the saved ones")
+    args = parser.parse_args()
+
+    bench_site("axius", legacy_axius, axius.extract_data_from_html, args.repeat, args.synthetic)
+    bench_site("inmocasal", legacy_inmocasal, inmocasal.extract_data_from_html, args.repeat, args.synthetic)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+"""Benchmark the new-listing detection and persistence paths against growing histories.
+
+For every history size, a synthetic history (see fixtures.py) is loaded into a
+PropertyStore, then a run's worth of result pages (half known listings, half
+new) is parsed and merged page by page as PropertySession.add does. The same
+pages go through cscrap.merge_dataframes, and the history is written with each
+storage backend. Every step is timed, then repeated under tracemalloc for its
+peak memory.
+
+    python benchmarks/bench_store.py [--sizes 300 3000 30000 300000 1000000] [--pages 20] [--json out.json]
+"""
+import argparse
+import itertools
+import json
+import os
+import sys
+import tempfile
+import time
+import tracemalloc
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ctools import cscrap  # noqa: E402
+from ctools import storage  # noqa: E402
+import axius  # noqa: E402
+import inmocasal  # noqa: E402
+import fixtures  # noqa: E402
+
+
+SIZES = [300, 3_000, 30_000, 300_000, 1_000_000]
+BACKENDS = ["pickle", "parquet"]
+
+
+def measure(function):
+    """(seconds, peak MiB, result) of one call; the peak comes from a second call under tracemalloc."""
+    start = time.perf_counter()
+    result = function()
+    seconds = time.perf_counter() - start
+
+    tracemalloc.start()
+    function()
+    _, peak = tracemalloc.get_traced_memory()
+    tracemalloc.stop()
+    return seconds, peak / 2**20, result
+
+
+def run_pages(size, pages):
+    """Result pages of both sites: half of the listings already in a history of `size`, half new."""
+    per_site = max(1, pages // 2)
+    known_start = max(0, size // 2 - per_site * fixtures.ITEMS_PER_PAGE // 2)
+    return [
+        (axius.iter_listings, page)
+        for page in fixtures.synthetic_pages("axius", per_site, start=known_start)
+    ] + [
+        (inmocasal.iter_listings, page)
+        for page in fixtures.synthetic_pages("inmocasal", per_site, start=known_start)
+    ]
+
+
+def bench_size(size, pages, backends):
+    history = fixtures.history(size)
+    sources = run_pages(size, pages)
+    results = {"size": size, "pages": len(sources)}
+
+    def row(step, seconds, peak, units, unit):
+        results[step] = {"seconds": round(seconds, 4), "peak_mib": round(peak, 1), f"{unit}_per_s": round(units / seconds, 1)}
+        print(f"  {step:<16} {seconds * 1000:10.1f} ms {units / seconds:14,.0f} {unit}/s {peak:10.1f} MiB peak")
+
+    print(f"history of {size:,} properties, {len(sources)} pages:")
+
+    seconds, peak, store = measure(lambda: cscrap.PropertyStore.from_frame(history))
+    row("load", seconds, peak, size, "rows")
+
+    seconds, peak, extracted = measure(lambda: [list(extract(page)) for extract, page in sources])
+    row("parse", seconds, peak, len(sources), "pages")
+
+    def detect():
+        detecting = cscrap.PropertyStore.from_frame(history)
+        start = time.perf_counter()
+        new = sum(len(detecting.upsert(frame)) for frame in extracted)
+        return time.perf_counter() - start, new
+
+    # The time only covers the page merges, not the copy of the store each call starts from
+    _, peak, (seconds, new) = measure(detect)
+    row("detect", seconds, peak, len(sources), "pages")
+    results["new_listings"] = new
+
+    batch = pd.DataFrame([row for page in extracted for row in page])
+    seconds, peak, _ = measure(lambda: cscrap.merge_dataframes(history, batch))
+    row("merge_dataframes", seconds, peak, size, "rows")
+
+    frame = store.to_frame()
+    with tempfile.TemporaryDirectory() as directory:
+        for backend in backends:
+            # A new file on every call, so the timed and the traced call both write the full history
+            paths = (os.path.join(directory, f"{backend}_{call}.pkl") for call in itertools.count())
+            seconds, peak, _ = measure(lambda: storage.save(frame, next(paths), backend))
+            row(f"save_{backend}", seconds, peak, size, "rows")
+    return results
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--sizes", type=int, nargs="+", default=SIZES)
+    parser.add_argument("--pages", type=int, default=20, help="result pages merged per run")
+    parser.add_argument("--backends", nargs="+", default=BACKENDS, choices=["pickle", "parquet"])
+    parser.add_argument("--json", help="also write the results to this file")
+    args = parser.parse_args()
+
+    results = [bench_size(size, args.pages, args.backends) for size in args.sizes]
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+
+
+if __name__ == "__main__":
+    main()
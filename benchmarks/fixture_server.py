@@ -0,0 +1,148 @@
+"""Local HTTP server that serves synthetic listing pages, for end-to-end runs without network access.
+
+    python benchmarks/fixture_server.py                   # serve until Ctrl+C
+    python benchmarks/fixture_server.py --run --pages 20  # full engine run against it
+    python benchmarks/fixture_server.py --run --details   # ... fetching the detail pages of the new listings
+
+Pages are served under /axius/ and /inmocasal/ with the markup of the real
+sites (see fixtures.py) and the same `pagina` numbering; detail pages are
+served under /<site>/ficha/?ref=. With --run, every registered site is
+pointed at the server with the plain HTTP backend and the engine scrapes it
+into a temporary results folder, then prints the run metrics.
+"""
+import argparse
+import os
+import sys
+import tempfile
+import threading
+import time
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ctools.clogger import logger  # noqa: E402
+from ctools import cscrap  # noqa: E402
+from ctools import details  # noqa: E402
+from ctools import engine  # noqa: E402
+from ctools import metrics  # noqa: E402
+from ctools import sites  # noqa: E402
+import fixtures  # noqa: E402
+
+
+# First page number of the `pagina` parameter of each site
+FIRST_PAGINA = {"axius": 0, "inmocasal": 1}
+
+
+def make_handler(pages, latency):
+    class FixtureHandler(BaseHTTPRequestHandler):
+        def do_GET(self):
+            url = urlparse(self.path)
+            name = url.path.strip("/").split("/")[0]
+            if url.path.strip("/").endswith("/ficha") and name in pages:
+                self.send_page(fixtures.detail_page(name, parse_qs(url.query).get("ref", [""])[0]))
+                return
+            pagina = int(parse_qs(url.query).get("pagina", [FIRST_PAGINA.get(name, 0)])[0])
+            index = pagina - FIRST_PAGINA.get(name, 0)
+            if name not in pages or not 0 <= index < len(pages[name]):
+                self.send_error(404)
+                return
+
+            self.send_page(pages[name][index])
+
+        def send_page(self, html):
+            time.sleep(latency)
+            body = html.encode("utf-8")
+            self.send_response(200)
+            self.send_header("Content-Type", "text/html; charset=utf-8")
+            self.send_header("Content-Length", str(len(body)))
+            self.end_headers()
+            self.wfile.write(body)
+
+        def log_message(self, format, *args):
+            pass
+
+    return FixtureHandler
+
+
+def serve(pages_per_site, port=0, latency=0.0):
+    """Start the server on a background thread; returns it (its URL is server.base_url)."""
+    pages = {name: fixtures.synthetic_pages(name, pages_per_site) for name in fixtures.HOSTS}
+    server = ThreadingHTTPServer(("127.0.0.1", port), make_handler(pages, latency))
+    server.base_url = f"http://127.0.0.1:{server.server_port}"
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    return server
+
+
+def local_sites(base_url):
+    """The registered sites, with their searches and detail pages pointed at the fixture server and fetched over plain HTTP."""
+    local = []
+    for site in sites.all_sites():
+        search = f"{base_url}/{site.name}/"
+        searches = [(search, f"{search}?pagina={{page}}")]
+        local.append(site._replace(
+            searches=lambda searches=searches: searches, fetcher="http", url_template=f"{search}ficha/?ref={{ref}}",
+        ))
+    return local
+
+
+class LocalEnricher(details.DetailEnricher):
+    """Fetches the detail pages from the fixture server: the listing URLs point at the live sites."""
+
+    def detail_url(self, site, item):
+        return site.url_template.format(ref=item.ref)
+
+
+def run(server, rate, with_details=False):
+    with tempfile.TemporaryDirectory() as directory:
+        # Fresh page cache, and a limiter sized for a local server instead of the live sites
+        cscrap.PAGE_CACHE.directory = os.path.join(directory, "cache")
+        cscrap.THROTTLE.rate = cscrap.THROTTLE.max_rate = rate
+
+        start = time.perf_counter()
+        properties = os.path.join(directory, "properties.pkl")
+        new_properties = os.path.join(directory, "new_properties.pkl")
+        with cscrap.PropertySession(properties, new_properties, sites.COLUMNS) as session:
+            local = local_sites(server.base_url)
+            enricher = None
+            if with_details:
+                # No per-run limit: every new listing of the run gets its details
+                enricher = LocalEnricher(session, local, os.path.join(directory, "details.sqlite"), max_pages=len(local) * 10**6)
+            engine.run(session, local, full_sweep=True, enricher=enricher)
+            if enricher:
+                enricher.finish()
+        seconds = time.perf_counter() - start
+
+        print(f"{len(session.store)} listings, {len(session.new_store)} new, in {seconds:.2f}s")
+        if enricher:
+            print(f"{enricher.stats['fetched']} detail pages fetched, {enricher.stats['failed']} failed")
+        metrics.write_summary(os.path.join(directory, "metrics"))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--pages", type=int, default=20, help="result pages served per site")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency", type=float, default=0.05, help="seconds the server takes per page")
+    parser.add_argument("--run", action="store_true", help="run the engine against the server and exit")
+    parser.add_argument("--rate", type=float, default=50, help="requests/second per host during --run")
+    parser.add_argument("--details", action="store_true", help="also fetch the detail pages of the new listings during --run")
+    args = parser.parse_args()
+
+    server = serve(args.pages, 0 if args.run else args.port, args.latency)
+    if args.run:
+        run(server, args.rate, args.details)
+        server.shutdown()
+        return
+
+    logger.info(f"Serving fixtures on {server.base_url}/axius/ and {server.base_url}/inmocasal/ (Ctrl+C to stop)")
+    try:
+        while True:
+            time.sleep(3600)
+    except KeyboardInterrupt:
+        server.shutdown()
+
+
+if __name__ == "__main__":
+    main()
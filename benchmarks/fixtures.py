@@ -0,0 +1,168 @@
+"""Listing-page fixtures for the offline benchmarks.
+
+Saved pages come from the old axius/ and inmocasal/ folders and from the page
+cache. Synthetic pages reproduce the markup the extractors and page counters
+read, so any number of pages (and any history size) can be generated without
+touching the live sites.
+"""
+import glob
+import os
+import random
+import sys
+from urllib.parse import urlparse
+
+import pandas as pd
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from ctools import cscrap  # noqa: E402
+
+
+HOSTS = {"axius": "arxus.es", "inmocasal": "inmocasal.es"}
+ITEMS_PER_PAGE = 12
+# Areas and property types of the synthetic listings
+TOWNS = ["La Felguera", "Sama", "Laviana", "Pola de Siero", "Mieres", "Oviedo", "Gijón", "Avilés", "Langreo", "Turón"]
+KINDS = ["Piso", "Casa", "Chalet", "Apartamento", "Dúplex"]
+STREETS = ["Calle Dorado", "Avenida de la Constitución", "Calle Pinzales", "Calle Jovellanos", "Plaza Mayor",
+           "Calle La Unión", "Calle Manuel Llaneza", "Calle Fray Paulino", "Avenida Galicia", "Calle Covadonga"]
+
+
+def saved_pages(name):
+    """HTML of the saved pages of a site: its old page folder plus its page cache entries."""
+    sources = []
+    for html_file in sorted(glob.glob(os.path.join(ROOT, name, "*.html"))):
+        with open(html_file, "r", encoding="utf-8") as file:
+            sources.append(file.read())
+    sources += [html for url, html in cscrap.PAGE_CACHE.entries() if urlparse(url).netloc.endswith(HOSTS[name])]
+    return sources
+
+
+def axius_ref(number):
+    return f"AX{number:07d}"
+
+
+def inmocasal_ref(number):
+    return f"{number:07d}"
+
+
+def euros(price):
+    """45000 -> '45.000', as the sites print prices."""
+    return f"{price:,}".replace(",", ".")
+
+
+def describe(rng):
+    """(title, area, size) of a synthetic listing."""
+    town = rng.choice(TOWNS)
+    street = f"{rng.choice(STREETS)} {rng.randrange(1, 80)}"
+    return f"{rng.choice(KINDS)} en venta en {street}", town, rng.randrange(40, 160)
+
+
+def axius_page(listings, total_items):
+    """Result page of arxus.es with `listings` as (ref, price, title, area, size) tuples."""
+    items = "".join(
+        f"""
+        <article id="inmueble_{ref}" class="mh-estate-vertical">
+          <div class="mh-estate-vertical__primary">
+            <h3>{title}</h3>
+            <div class="mh-estate-vertical__address">{area}</div>
+            <span>Ref.: {ref}</span>
+            <span>Precio: {euros(price)} €</span>
+            <span>Superficie: {size} m²</span>
+          </div>
+        </article>"""
+        for ref, price, title, area, size in listings
+    )
+    return f"""<html><head><title>Propiedades</title></head><body>
+      <ul><li class="mh-search__results">{total_items} resultados</li></ul>
+      <div class="mh-grid">{items}</div>
+    </body></html>"""
+
+
+def inmocasal_page(listings, total_pages):
+    """Result page of inmocasal.es with `listings` as (ref, price, title, area, size) tuples."""
+    items = "".join(
+        f"""
+        <div class="zt-prop-blog-minis-item">
+          <a href="/propiedad/?referencia={ref}"><img src="foto.jpg"></a>
+          <h4>{title}</h4>
+          <p class="zt-location">{area}</p>
+          <p><strong>Ref. {ref}</strong></p>
+          <p><b>{euros(price)} €</b></p>
+          <p>{size} m²</p>
+        </div>"""
+        for ref, price, title, area, size in listings
+    )
+    return f"""<html><head><title>Búsqueda avanzada</title></head><body>
+      <div class="zt-listado">{items}</div>
+      <div class="zt-paginacion"><span>Página 1 de {total_pages}</span></div>
+    </body></html>"""
+
+
+def detail_page(name, ref):
+    """Detail page of listing `ref` of site `name`, with the markup its extract_details reads."""
+    rng = random.Random(f"{name}-{ref}")
+    title, area, size = describe(rng)
+    rooms = rng.randrange(1, 6)
+    photos = "".join(f'<a href="/fotos/{ref}-{photo}.jpg"><img src="/fotos/{ref}-{photo}-thumb.jpg"></a>' for photo in range(rng.randrange(1, 8)))
+    if name == "axius":
+        body = f"""
+      <h1>{title}</h1>
+      <div class="mh-estate__section mh-estate__section--address">{area}</div>
+      <ul class="mh-estate__list"><li>Superficie construida: {size} m²</li><li>Habitaciones: {rooms}</li></ul>
+      <div class="mh-estate__gallery">{photos}</div>"""
+    else:
+        body = f"""
+      <h1>{title}</h1>
+      <p class="zt-location">{area}</p>
+      <ul class="zt-caracteristicas"><li>{size} m² construidos</li><li>{rooms} dormitorios</li></ul>
+      <div class="zt-galeria">{photos}</div>"""
+    return f"<html><head><title>{title}</title></head><body>{body}</body></html>"
+
+
+def synthetic_pages(name, pages, per_page=ITEMS_PER_PAGE, start=0, seed=0):
+    """`pages` result pages of site `name` with consecutive refs from `start`."""
+    rng = random.Random(seed)
+    make_ref = axius_ref if name == "axius" else inmocasal_ref
+    sources = []
+    for page in range(pages):
+        numbers = range(start + page * per_page, start + (page + 1) * per_page)
+        listings = [(make_ref(number), rng.randrange(20_000, 75_000, 500), *describe(rng)) for number in numbers]
+        if name == "axius":
+            sources.append(axius_page(listings, pages * per_page))
+        else:
+            sources.append(inmocasal_page(listings, pages))
+    return sources
+
+
+def history(size, seed=0, duplicates=0.0):
+    """Properties history of `size` listings, split between both sites, as loaded by PropertySession.
+
+    The last `duplicates` share of the listings repeat an earlier flat under
+    their own ref: same area, a size within 1 m², a price within 2% and a
+    shorter title ("Piso en Calle Dorado 3" for "Piso en venta en Calle Dorado 3").
+    """
+    rng = random.Random(seed)
+    half = size // 2
+    refs = [axius_ref(number) for number in range(half)] + [inmocasal_ref(number) for number in range(size - half)]
+    sites = ["axius"] * half + ["inmocasal"] * (size - half)
+    urls = [
+        f"https://arxus.es/ficha-inmueble/?cod_inmueble={ref}" if site == "axius"
+        else f"https://www.inmocasal.es/propiedad/?referencia={ref}"
+        for ref, site in zip(refs, sites)
+    ]
+    prices = [rng.randrange(20_000, 75_000, 500) for _ in range(size)]
+    titles, areas, sizes = map(list, zip(*(describe(rng) for _ in range(size)))) if size else ([], [], [])
+
+    copies = int(size * duplicates)
+    for index in range(size - copies, size):
+        source = rng.randrange(0, size - copies)
+        prices[index] = round(prices[source] * rng.uniform(0.98, 1.02))
+        titles[index] = titles[source].replace(" en venta", "")
+        areas[index] = areas[source]
+        sizes[index] = sizes[source] + rng.choice([-1, 0, 0, 1])
+
+    return pd.DataFrame({
+        "ref": refs, "price": [euros(price) for price in prices], "url": urls, "inmobiliaria": sites,
+        "title": titles, "area": areas, "size": sizes,
+    })
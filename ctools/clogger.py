@@ -1,46 +1,101 @@
-import logging
-import os
-import pandas as pd
-import builtins
-
-# Ensure the log file exists
-log_file = 'do_scrap.log'
-if not os.path.exists(log_file):
-    with open(log_file, 'w') as f:
-        f.write("")  # Create an empty log file if it doesn't exist
-
-# Global logger configuration
-logger = logging.getLogger('scrap_logging')
-if not logger.handlers:  # Prevent duplicate handlers
-    logger.setLevel(logging.DEBUG)
-
-    # File handler
-    file_handler = logging.FileHandler(log_file)
-    file_handler.setLevel(logging.DEBUG)
-    file_handler.setFormatter(
-        logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    )
-    logger.addHandler(file_handler)
-
-    # Console handler
-    console_handler = logging.StreamHandler()
-    console_handler.setLevel(logging.INFO)
-    console_handler.setFormatter(
-        logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
-    )
-    logger.addHandler(console_handler)
-
-# Override the print function
-original_print = builtins.print
-
-def custom_print(*args, **kwargs):
-    for arg in args:
-        if isinstance(arg, pd.DataFrame):
-            # Log the DataFrame to the file
-            logger.debug("\n" + arg.to_string())
-        else:
-            # Use the original print for non-DataFrame objects
-            original_print(arg, **kwargs)
-
-# Replace the built-in print with the custom print
-builtins.print = custom_print
+"""Logging of the scraper, off the scrape threads.
+
+`logger` only puts records on an in-memory queue (QueueHandler); a
+QueueListener thread formats and writes them: JSON lines to a size-rotated
+do_scrap.log, and readable lines to the console. DataFrames are logged as
+summaries (see frame_summary), never rendered in full.
+"""
+import atexit
+import builtins
+import json
+import logging
+import logging.handlers
+import queue
+
+import pandas as pd
+
+log_file = 'do_scrap.log'
+# Rotation of the log file: size of each file and number of old files kept
+LOG_MAX_BYTES = 1024 * 1024
+LOG_BACKUP_COUNT = 3
+
+
+class JsonFormatter(logging.Formatter):
+    """One JSON object per line: time, level, logger, thread, message (and exception)."""
+
+    def format(self, record):
+        entry = {
+            "time": self.formatTime(record),
+            "level": record.levelname,
+            "logger": record.name,
+            "thread": record.threadName,
+            "message": record.getMessage(),
+        }
+        if record.exc_info:
+            entry["exception"] = self.formatException(record.exc_info)
+        return json.dumps(entry, ensure_ascii=False)
+
+
+def frame_summary(dataframe, previous=None, name="DataFrame"):
+    """'name: 1234 rows (+12) x 6 columns' instead of the whole frame."""
+    if dataframe is None:
+        return f"{name}: None"
+    summary = f"{name}: {len(dataframe)} rows"
+    if previous is not None:
+        summary += f" ({len(dataframe) - previous:+d})"
+    return f"{summary} x {len(dataframe.columns)} columns"
+
+
+# Global logger configuration
+logger = logging.getLogger('scrap_logging')
+if not logger.handlers:  # Prevent duplicate handlers
+    logger.setLevel(logging.DEBUG)
+
+    # File handler: JSON lines, rotated by size
+    file_handler = logging.handlers.RotatingFileHandler(
+        log_file, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8', delay=True
+    )
+    file_handler.setLevel(logging.DEBUG)
+    file_handler.setFormatter(JsonFormatter())
+
+    # Console handler
+    console_handler = logging.StreamHandler()
+    console_handler.setLevel(logging.INFO)
+    console_handler.setFormatter(
+        logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+    )
+
+    # The scrape threads only enqueue; the listener thread does the I/O
+    log_queue = queue.SimpleQueue()
+    logger.addHandler(logging.handlers.QueueHandler(log_queue))
+    listener = logging.handlers.QueueListener(log_queue, file_handler, console_handler, respect_handler_level=True)
+    listener.start()
+    atexit.register(listener.stop)
+
+
+def log_to(path):
+    """Write the log file to `path` from now on: processes must not rotate the same file."""
+    global file_handler
+    handler = logging.handlers.RotatingFileHandler(
+        path, maxBytes=LOG_MAX_BYTES, backupCount=LOG_BACKUP_COUNT, encoding='utf-8', delay=True
+    )
+    handler.setLevel(logging.DEBUG)
+    handler.setFormatter(JsonFormatter())
+    listener.handlers = tuple(handler if h is file_handler else h for h in listener.handlers)
+    file_handler.close()
+    file_handler = handler
+
+# Override the print function
+original_print = builtins.print
+
+def custom_print(*args, **kwargs):
+    for arg in args:
+        if isinstance(arg, pd.DataFrame):
+            # Log a summary of the DataFrame, not the whole frame
+            logger.debug(frame_summary(arg))
+        else:
+            # Use the original print for non-DataFrame objects
+            original_print(arg, **kwargs)
+
+# Replace the built-in print with the custom print
+builtins.print = custom_print
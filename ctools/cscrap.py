@@ -1,99 +1,750 @@
-import os
-import pandas as pd
-from selenium import webdriver
-from selenium.webdriver.chrome.service import Service
-from selenium.webdriver.chrome.options import Options
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support.ui import WebDriverWait
-from selenium.webdriver.support import expected_conditions as EC
-from webdriver_manager.chrome import ChromeDriverManager
-import time
-import random
-
-from ctools.clogger import logger
-
-
-
-def initialize_driver():
-    """Initialize and return a Selenium WebDriver with configured options."""
-    options = Options()
-    options.add_argument("--headless")
-    options.add_argument("--disable-blink-features=AutomationControlled")
-    options.add_argument("--disable-gpu")
-    options.add_argument("--no-sandbox")
-    options.add_argument("--disable-dev-shm-usage")
-    options.add_argument("--incognito")
-    options.add_argument(
-        "user-agent=Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/102.0.0.0 Safari/537.36"
-    )
-    service = Service(ChromeDriverManager().install())
-    return webdriver.Chrome(service=service, options=options)
-
-def save_html(driver, url, output_file, max_retries=2, wait_until=None, wait_timeout=10):
-    if os.path.exists(output_file):
-        logger.info(f"Skipping download: {output_file} already exists.")
-        return
-
-    retries = 0
-    while retries < max_retries:
-        try:
-            time.sleep(random.uniform(2, 5))
-            logger.info(f'Entrando en la web: {url}')
-            driver.get(url)
-
-            # If there's a wait condition, apply it
-            if wait_until:
-                WebDriverWait(driver, wait_timeout).until(wait_until)
-
-            # Save the HTML content
-            with open(output_file, "w", encoding="utf-8") as file:
-                file.write(driver.page_source)
-
-            # Check if the file has content
-            if os.path.getsize(output_file) > 0:
-                logger.info(f"HTML saved to {output_file}.")
-                return
-            else:
-                logger.warning(f"Empty HTML content for {url}. Retrying...")
-                retries += 1
-
-        except Exception as e:
-            logger.error(f"Error accessing {url} on attempt {retries + 1}: {e}")
-            retries += 1
-
-    logger.error(f"Failed to save non-empty HTML content for {url} after {max_retries} retries.")
-
-# def save_html(driver, url, output_file):
-#     """Save the HTML content of a URL to a local file."""
-#     if os.path.exists(output_file):
-#         logger.info(f"Skipping download: {output_file} already exists.")
-#         return
-
-#     try:
-#         time.sleep(random.uniform(2, 5))
-#         print(f'Entrando en la web: {url}')
-#         driver.get(url)
-#         with open(output_file, "w", encoding="utf-8") as file:
-#             file.write(driver.page_source)
-#         logger.info(f"HTML saved to {output_file}.")
-#     except Exception as e:
-#         logger.error(f"Error accessing {url}: {e}")
-
-
-def load_or_initialize_pickle(file_path, columns):
-    """Load existing pickle file or initialize a new DataFrame."""
-    if os.path.exists(file_path):
-        return pd.read_pickle(file_path)
-    return pd.DataFrame(columns=columns)
-
-
-def save_to_pickle(dataframe, file_path):
-    """Save a DataFrame to a pickle file."""
-    dataframe.to_pickle(file_path)
-
-
-
-def merge_dataframes(existing_df, new_df):
-    """Merge existing DataFrame with new data, avoiding duplicates based on 'ref' and 'inmobiliaria'."""
-    combined_df = pd.concat([existing_df, new_df]).drop_duplicates(subset=["ref", "inmobiliaria"], keep="last").reset_index(drop=True)
-    return combined_df
+import re
+import pandas as pd
+import requests
+from requests.adapters import HTTPAdapter
+import lxml.html
+from lxml import etree
+from lxml.cssselect import CSSSelector
+from selenium import webdriver
+from selenium.webdriver.chrome.service import Service
+from selenium.webdriver.chrome.options import Options
+from selenium.webdriver.common.by import By
+from selenium.webdriver.support.ui import WebDriverWait
+from selenium.webdriver.support import expected_conditions as EC
+from selenium.common.exceptions import TimeoutException
+from webdriver_manager.chrome import ChromeDriverManager
+from concurrent.futures import ThreadPoolExecutor
+from collections import namedtuple
+from contextlib import contextmanager
+from functools import lru_cache
+from urllib.parse import urlparse
+import queue
+import threading
+import time
+import random
+
+from ctools.clogger import logger
+from ctools import storage
+from ctools import time_lapse
+from ctools import metrics
+from ctools import listing
+from ctools.page_cache import PageCache
+
+
+# Number of headless Chrome instances fetching pages in parallel
+POOL_SIZE = 3
+# Politeness per host: token bucket whose rate (requests/second) adapts between the bounds,
+# additive increase after each healthy response, multiplicative decrease after a failure
+HOST_RATE = 0.5
+HOST_RATE_BOUNDS = (0.1, 2.0)
+HOST_RATE_INCREASE = 0.05
+HOST_RATE_DECREASE = 0.5
+HOST_BURST = 2
+HOST_MAX_CONCURRENT = 3
+# Exponential backoff (seconds) of a host after consecutive failures, with jitter
+BACKOFF_BASE = 2
+BACKOFF_MAX = 60
+# Pages merged in memory between two checkpoints of the properties pickle files
+FLUSH_EVERY = 10
+# Pages a browser renders before it is replaced by a fresh one
+DRIVER_MAX_PAGES = 50
+# Pages in a row that only the browser could read before the 'auto' backend sends a host straight to the browser
+AUTO_BROWSER_AFTER = 3
+# Content settings of the browser profile: 2 = block. Listings only need the DOM
+BROWSER_PREFS = {
+    "profile.managed_default_content_settings.images": 2,
+    "profile.managed_default_content_settings.stylesheets": 2,
+}
+# Requests the browser never makes (fonts have no content setting)
+BLOCKED_URLS = ["*.woff", "*.woff2", "*.ttf", "*.otf", "*.eot", "*.css", "*.png", "*.jpg", "*.jpeg", "*.gif", "*.webp", "*.svg"]
+# Incremental crawl: a newest-first search stops after this many pages without unseen listings
+EARLY_STOP_PAGES = 2
+# Days between two full sweeps of every page of every search
+FULL_SWEEP_EVERY_DAYS = 7
+# Storage backend of the properties history: 'pickle', 'parquet' or 'sqlite' (see ctools.storage)
+STORAGE_BACKEND = "parquet"
+
+USER_AGENT = "Mozilla/5.0 (Windows NT 10.0; Win64; x64) AppleWebKit/537.36 (KHTML, like Gecko) Chrome/102.0.0.0 Safari/537.36"
+
+
+
+@lru_cache(maxsize=None)
+def chromedriver_path():
+    """Resolve (downloading it if needed) the chromedriver binary once per process."""
+    return ChromeDriverManager().install()
+
+
+def initialize_driver():
+    """Initialize and return a Selenium WebDriver with configured options."""
+    options = Options()
+    options.add_argument("--headless")
+    options.add_argument("--disable-blink-features=AutomationControlled")
+    options.add_argument("--disable-gpu")
+    options.add_argument("--no-sandbox")
+    options.add_argument("--disable-dev-shm-usage")
+    options.add_argument("--incognito")
+    options.add_argument(f"user-agent={USER_AGENT}")
+    options.add_experimental_option("prefs", BROWSER_PREFS)
+    service = Service(chromedriver_path())
+    driver = webdriver.Chrome(service=service, options=options)
+    driver.execute_cdp_cmd("Network.enable", {})
+    driver.execute_cdp_cmd("Network.setBlockedURLs", {"urls": BLOCKED_URLS})
+    return driver
+
+
+class HostRateLimiter:
+    """Per-host politeness: an adaptive token bucket plus a cap on requests in flight.
+
+    Each host starts at HOST_RATE requests per second. Every healthy response
+    raises its rate a little, every failure (error status, timeout, empty page)
+    halves it and pauses the host with an exponential, jittered backoff. A
+    single instance is shared by all the workers, so the limit holds per host
+    whatever the number of drivers or threads.
+    """
+
+    def __init__(self, rate=HOST_RATE, bounds=HOST_RATE_BOUNDS, burst=HOST_BURST, max_concurrent=HOST_MAX_CONCURRENT):
+        self.rate = rate
+        self.min_rate, self.max_rate = bounds
+        self.burst = burst
+        self.max_concurrent = max_concurrent
+        self._lock = threading.Lock()
+        self._hosts = {}
+
+    def _host(self, url):
+        host = urlparse(url).netloc
+        if host not in self._hosts:
+            self._hosts[host] = {
+                "rate": self.rate, "tokens": self.burst, "updated": time.monotonic(),
+                "failures": 0, "resume_at": 0.0, "in_flight": threading.Semaphore(self.max_concurrent),
+            }
+        return self._hosts[host]
+
+    @contextmanager
+    def slot(self, url):
+        """Block until a request to the host of `url` is allowed, and hold the slot during the block."""
+        with self._lock:
+            state = self._host(url)
+        with state["in_flight"]:
+            with self._lock:
+                now = time.monotonic()
+                state["tokens"] = min(self.burst, state["tokens"] + (now - state["updated"]) * state["rate"])
+                state["updated"] = now
+                state["tokens"] -= 1
+                wait = max(-state["tokens"] / state["rate"], state["resume_at"] - now, 0)
+            time.sleep(wait)
+            yield
+
+    def success(self, url):
+        with self._lock:
+            state = self._host(url)
+            state["failures"] = 0
+            state["rate"] = min(self.max_rate, state["rate"] + HOST_RATE_INCREASE)
+
+    def failure(self, url):
+        with self._lock:
+            state = self._host(url)
+            state["failures"] += 1
+            state["rate"] = max(self.min_rate, state["rate"] * HOST_RATE_DECREASE)
+            backoff = min(BACKOFF_MAX, BACKOFF_BASE * 2 ** (state["failures"] - 1))
+            backoff = random.uniform(backoff / 2, backoff)
+            state["resume_at"] = max(state["resume_at"], time.monotonic() + backoff)
+        logger.warning(f"Backing off {urlparse(url).netloc} for {backoff:.1f}s (rate {state['rate']:.2f} req/s).")
+
+
+THROTTLE = HostRateLimiter()
+PAGE_CACHE = PageCache()
+
+
+class DriverPool:
+    """Warm headless Chrome drivers, started lazily up to `size` and shared by worker threads.
+
+    Used as a context manager around a whole run, so a browser is started once
+    per worker instead of once per search. A driver is quit and replaced after
+    `max_pages` pages, or as soon as it fails.
+    """
+
+    def __init__(self, size=POOL_SIZE, max_pages=DRIVER_MAX_PAGES):
+        self.size = size
+        self.max_pages = max_pages
+        self._idle = queue.Queue()
+        self._drivers = {}
+        self._started = 0
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.quit()
+
+    @contextmanager
+    def driver(self):
+        """Check out a driver for the duration of the block."""
+        driver = self._checkout()
+        try:
+            yield driver
+        except TimeoutException:
+            # The page lacked the expected element; the browser itself is fine
+            self._checkin(driver)
+            raise
+        except Exception:
+            self._recycle(driver, "failed")
+            raise
+        self._checkin(driver)
+
+    def _checkout(self):
+        with self._lock:
+            start_new = self._idle.empty() and self._started < self.size
+            if start_new:
+                self._started += 1
+        if not start_new:
+            driver = self._idle.get()
+            if driver is not None:
+                return driver
+            # None is the place left by a recycled driver: start its replacement
+
+        try:
+            driver = initialize_driver()
+        except Exception:
+            # The slot goes back as a placeholder, so a thread waiting for a driver tries (or fails) in turn
+            self._idle.put(None)
+            raise
+        with self._lock:
+            self._drivers[driver] = 0
+        return driver
+
+    def _checkin(self, driver):
+        with self._lock:
+            self._drivers[driver] += 1
+            worn_out = self._drivers[driver] >= self.max_pages
+        if worn_out:
+            self._recycle(driver, f"rendered {self.max_pages} pages")
+        else:
+            self._idle.put(driver)
+
+    def _recycle(self, driver, reason):
+        logger.info(f"Recycling a browser that {reason}.")
+        with self._lock:
+            self._drivers.pop(driver, None)
+        try:
+            driver.quit()
+        except Exception as e:
+            logger.error(f"Error closing driver: {e}")
+        self._idle.put(None)
+
+    def quit(self):
+        with self._lock:
+            drivers = list(self._drivers)
+            self._drivers = {}
+            self._started = 0
+            self._idle = queue.Queue()
+        for driver in drivers:
+            try:
+                driver.quit()
+            except Exception as e:
+                logger.error(f"Error closing driver: {e}")
+
+
+def has_class(html, class_name):
+    """Cheap check for an element with `class_name` in raw HTML, used in place of a browser wait condition."""
+    pattern = r"""class=["'](?:[^"']*\s)?""" + re.escape(class_name) + r"""(?:\s[^"']*)?["']"""
+    return re.search(pattern, html) is not None
+
+
+class NeedsJavaScript(Exception):
+    """The static HTML of a page lacks the content we wait for."""
+
+
+FetchResult = namedtuple("FetchResult", "html etag last_modified not_modified", defaults=(None, None, False))
+
+
+class Fetcher:
+    """Page download backend. `fetch` returns the HTML of `url` once an element with class `wait_for` is present."""
+
+    def fetch(self, url, wait_for=None, timeout=10):
+        raise NotImplementedError
+
+    def fetch_response(self, url, wait_for=None, timeout=10, etag=None, last_modified=None):
+        """Like `fetch`, with HTTP validators. Backends that can't revalidate always return the full page."""
+        return FetchResult(self.fetch(url, wait_for, timeout))
+
+    def close(self):
+        pass
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.close()
+
+
+class HttpFetcher(Fetcher):
+    """Plain HTTP backend: one requests session with pooled keep-alive connections, no browser."""
+
+    def __init__(self, pool_size=POOL_SIZE, headers=None):
+        self.session = requests.Session()
+        self.session.headers.update({"User-Agent": USER_AGENT, "Accept-Language": "es-ES,es;q=0.9"})
+        self.session.headers.update(headers or {})
+        adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def fetch(self, url, wait_for=None, timeout=10):
+        return self.fetch_response(url, wait_for, timeout).html
+
+    def fetch_response(self, url, wait_for=None, timeout=10, etag=None, last_modified=None):
+        """Conditional GET: answers not_modified when the server confirms the cached copy is current."""
+        headers = {}
+        if etag:
+            headers["If-None-Match"] = etag
+        if last_modified:
+            headers["If-Modified-Since"] = last_modified
+        response = self.session.get(url, timeout=timeout, headers=headers)
+        if response.status_code == 304:
+            return FetchResult(None, etag, last_modified, not_modified=True)
+        response.raise_for_status()
+        html = response.text
+        if wait_for and not has_class(html, wait_for):
+            raise NeedsJavaScript(f"'{wait_for}' not found in the static HTML of {url}")
+        return FetchResult(html, response.headers.get("ETag"), response.headers.get("Last-Modified"))
+
+    def close(self):
+        self.session.close()
+
+
+class SeleniumFetcher(Fetcher):
+    """Headless Chrome backend, for pages whose content is rendered by JavaScript.
+
+    Pass a run-wide DriverPool as `pool` to share its warm browsers between
+    sites; the fetcher then leaves quitting them to the pool's owner.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, pool=None):
+        self.owns_pool = pool is None
+        self.pool = DriverPool(pool_size) if pool is None else pool
+
+    def fetch(self, url, wait_for=None, timeout=10):
+        host = urlparse(url).netloc
+        with self.pool.driver() as driver:
+            with metrics.timer("render", host):
+                driver.get(url)
+
+            # If there's a wait condition, apply it
+            if wait_for:
+                condition = EC.presence_of_element_located((By.CLASS_NAME, wait_for))
+                with metrics.timer("wait_for", host):
+                    WebDriverWait(driver, timeout).until(condition)
+
+            return driver.page_source
+
+    def close(self):
+        if self.owns_pool:
+            self.pool.quit()
+
+
+class AutoFetcher(Fetcher):
+    """HTTP first; falls back to Selenium for pages whose content is missing from the static HTML.
+
+    A page missing its content may just be empty (a search with no results),
+    so only a host whose last AUTO_BROWSER_AFTER pages all needed the browser,
+    and were read by it, sends its next pages straight to Selenium. The
+    browser is only started the first time it is needed.
+    """
+
+    def __init__(self, pool_size=POOL_SIZE, pool=None):
+        self.pool_size = pool_size
+        self.pool = pool
+        self.http = HttpFetcher(pool_size)
+        self._browser = None
+        self._browser_hosts = set()
+        # host -> pages in a row that only the browser could read
+        self._browser_reads = {}
+        self._lock = threading.Lock()
+
+    @property
+    def browser(self):
+        with self._lock:
+            if self._browser is None:
+                self._browser = SeleniumFetcher(self.pool_size, self.pool)
+            return self._browser
+
+    def fetch(self, url, wait_for=None, timeout=10):
+        return self.fetch_response(url, wait_for, timeout).html
+
+    def fetch_response(self, url, wait_for=None, timeout=10, etag=None, last_modified=None):
+        host = urlparse(url).netloc
+        if host in self._browser_hosts:
+            return self.browser.fetch_response(url, wait_for, timeout)
+        try:
+            result = self.http.fetch_response(url, wait_for, timeout, etag, last_modified)
+            with self._lock:
+                self._browser_reads.pop(host, None)
+            return result
+        except NeedsJavaScript as e:
+            logger.info(f"{e}. Falling back to Selenium for this page.")
+
+        # Raises when the browser does not find the content either: the page is not counted
+        result = self.browser.fetch_response(url, wait_for, timeout)
+        with self._lock:
+            reads = self._browser_reads[host] = self._browser_reads.get(host, 0) + 1
+            if reads >= AUTO_BROWSER_AFTER:
+                self._browser_hosts.add(host)
+                logger.info(f"{host} needed the browser for {reads} pages in a row: its next pages go to Selenium.")
+        return result
+
+    def close(self):
+        self.http.close()
+        if self._browser is not None:
+            self._browser.close()
+
+
+FETCHERS = {"http": HttpFetcher, "selenium": SeleniumFetcher, "auto": AutoFetcher}
+
+
+def get_fetcher(kind, pool_size=POOL_SIZE, pool=None):
+    """Build the fetch backend a site module asks for: 'http', 'selenium' or 'auto'.
+
+    Browser backends render with the drivers of `pool` when one is given.
+    """
+    if kind == "http" or pool is None:
+        return FETCHERS[kind](pool_size)
+    return FETCHERS[kind](pool_size, pool=pool)
+
+
+def fetch_pages(fetcher, urls, wait_for=None, workers=POOL_SIZE, throttle=THROTTLE):
+    """Download a list of page URLs in parallel through `fetcher`; returns their HTML in order."""
+    def fetch(url):
+        return save_html(fetcher, url, wait_for=wait_for, throttle=throttle)
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        return list(executor.map(fetch, urls))
+
+
+def full_sweep_due():
+    """True when the last full sweep is FULL_SWEEP_EVERY_DAYS old or was never recorded."""
+    days = time_lapse.days_since_last_full_sweep()
+    return days < 0 or days >= FULL_SWEEP_EVERY_DAYS
+
+
+def save_html(fetcher, url, max_retries=2, wait_for=None, wait_timeout=10, throttle=THROTTLE, cache=PAGE_CACHE):
+    """Return the HTML of `url` (None on failure).
+
+    Fresh pages come from the page cache. Otherwise the page is downloaded, or
+    revalidated with ETag/Last-Modified where the backend supports it, and
+    saved to the cache. Each outcome feeds the host's rate limiter, so a
+    retry waits for the host's backoff. If every attempt fails, a stale cached
+    copy is used.
+    """
+    host = urlparse(url).netloc
+    entry = cache.get(url)
+    if entry is not None and entry.fresh:
+        metrics.count("cache_hit", default_site=host)
+        logger.info(f"Skipping download: {url} is cached.")
+        return entry.html
+    metrics.count("cache_miss", default_site=host)
+
+    retries = 0
+    while retries < max_retries:
+        if retries:
+            metrics.count("retry", default_site=host)
+        try:
+            requested_at = time.perf_counter()
+            with throttle.slot(url):
+                metrics.record("throttle_wait", time.perf_counter() - requested_at, host)
+                logger.info(f'Entrando en la web: {url}')
+                with metrics.timer("fetch", host):
+                    result = fetcher.fetch_response(
+                        url, wait_for=wait_for, timeout=wait_timeout,
+                        etag=entry.etag if entry else None,
+                        last_modified=entry.last_modified if entry else None,
+                    )
+
+            if result.not_modified:
+                throttle.success(url)
+                metrics.count("not_modified", default_site=host)
+                logger.info(f"Not modified since the cached copy: {url}.")
+                cache.touch(url, result.etag, result.last_modified)
+                return entry.html
+
+            # Check if the page has content
+            if result.html:
+                throttle.success(url)
+                metrics.count("bytes", len(result.html.encode("utf-8")), default_site=host)
+                cache.put(url, result.html, result.etag, result.last_modified)
+                logger.info(f"HTML of {url} saved to the page cache.")
+                return result.html
+            else:
+                logger.warning(f"Empty HTML content for {url}. Retrying...")
+                throttle.failure(url)
+                retries += 1
+
+        except Exception as e:
+            logger.error(f"Error accessing {url} on attempt {retries + 1}: {e}")
+            throttle.failure(url)
+            retries += 1
+
+    logger.error(f"Failed to save non-empty HTML content for {url} after {max_retries} retries.")
+    metrics.count("fetch_failed", default_site=host)
+    if entry is not None:
+        logger.warning(f"Using the stale cached copy of {url}.")
+        return entry.html
+
+# def save_html(driver, url, output_file):
+#     """Save the HTML content of a URL to a local file."""
+#     if os.path.exists(output_file):
+#         logger.info(f"Skipping download: {output_file} already exists.")
+#         return
+
+#     try:
+#         time.sleep(random.uniform(2, 5))
+#         print(f'Entrando en la web: {url}')
+#         driver.get(url)
+#         with open(output_file, "w", encoding="utf-8") as file:
+#             file.write(driver.page_source)
+#         logger.info(f"HTML saved to {output_file}.")
+#     except Exception as e:
+#         logger.error(f"Error accessing {url}: {e}")
+
+
+@lru_cache(maxsize=None)
+def css(selector):
+    """CSS selector compiled once (to XPath) and reused on every page."""
+    return CSSSelector(selector)
+
+
+@lru_cache(maxsize=None)
+def xpath(expression):
+    """XPath expression compiled once and reused on every page."""
+    return etree.XPath(expression)
+
+
+def parse_html(page_source, containers=None):
+    """Parse page HTML from memory with lxml (C parser).
+
+    With `containers`, only the elements matching that CSS selector are
+    returned, so extractors never walk the rest of the document.
+    """
+    root = lxml.html.fromstring(page_source)
+    if containers:
+        return css(containers)(root)
+    return root
+
+
+def select(element, selector):
+    """Elements under `element` matching a CSS selector."""
+    return css(selector)(element)
+
+
+def load_or_initialize_pickle(file_path, columns, backend="pickle"):
+    """Load existing pickle file (or the `backend` store behind it) or initialize a new DataFrame."""
+    return storage.load(file_path, columns, backend)
+
+
+def save_to_pickle(dataframe, file_path, backend="pickle"):
+    """Save a DataFrame to a pickle file (or the `backend` store behind it)."""
+    storage.save(dataframe, file_path, backend)
+
+
+
+def merge_dataframes(existing_df, new_df):
+    """Merge existing DataFrame with new data, avoiding duplicates based on 'ref' and 'inmobiliaria'.
+
+    The new rows win, but a listing keeps its earliest first_seen (vectorized,
+    without building a PropertyStore of the whole history).
+    """
+    combined_df = pd.concat([existing_df, new_df], ignore_index=True)
+    if "first_seen" in combined_df:
+        first_seen = combined_df.groupby(["ref", "inmobiliaria"], dropna=False)["first_seen"].transform("min")
+        combined_df = combined_df.assign(first_seen=first_seen)
+    return combined_df.drop_duplicates(subset=["ref", "inmobiliaria"], keep="last").reset_index(drop=True)
+
+
+class PropertyStore:
+    """Listings indexed by (inmobiliaria, ref), held as compact Listing records.
+
+    Membership tests are O(1) and upserts cost O(batch), so merging a page no
+    longer depends on how many properties have ever been seen. DataFrames are
+    only built by to_frame(), for storage and email.
+    """
+
+    def __init__(self, columns):
+        self.columns = list(dict.fromkeys(list(columns) + storage.SEEN_COLUMNS))
+        self._rows = {}
+
+    @classmethod
+    def from_frame(cls, dataframe):
+        store = cls(dataframe.columns)
+        store.upsert(dataframe)
+        return store
+
+    def __contains__(self, key):
+        return key in self._rows
+
+    def __len__(self):
+        return len(self._rows)
+
+    def __iter__(self):
+        return iter(self._rows.values())
+
+    def get(self, key):
+        return self._rows.get(key)
+
+    def new_rows(self, listings):
+        """Return the listings (records, row dicts or DataFrame rows) whose key is not in the store yet."""
+        if isinstance(listings, pd.DataFrame):
+            listings = listing.from_frame(listings)
+        new = {item.key: item for item in map(listing.as_listing, listings) if item.key not in self._rows}
+        return list(new.values())
+
+    def upsert(self, listings):
+        """Insert or replace listings and return the ones that were new.
+
+        `listings` may be Listing records, row dicts, a generator of either, or
+        a DataFrame; a generator is consumed as it is merged.
+        """
+        if isinstance(listings, pd.DataFrame):
+            listings = listing.from_frame(listings)
+        now = pd.Timestamp.now()
+        new_keys = []
+        for item in map(listing.as_listing, listings):
+            previous = self._rows.get(item.key)
+            if previous is None:
+                new_keys.append(item.key)
+                item.first_seen = item.first_seen or now
+            else:
+                item.first_seen = previous.first_seen
+                item.keep_details(previous)
+            item.last_seen = item.last_seen or now
+            if previous is not None and previous.last_seen is not None and previous.last_seen > item.last_seen:
+                # An older observation (e.g. re-extracted from the page cache) never moves last_seen back
+                item.last_seen = previous.last_seen
+            self._rows[item.key] = item
+        return [self._rows[key] for key in dict.fromkeys(new_keys)]
+
+    def to_frame(self):
+        return listing.to_frame(list(self._rows.values()), self.columns)
+
+
+class PropertySession:
+    """Properties store loaded once per run, updated in memory page by page.
+
+    Listings from every page and site are merged in memory and new ones are
+    collected apart; the pickle files are only written every `flush_every`
+    pages and on commit(), so a crash loses at most one checkpoint.
+    Used as a context manager, it commits when the block exits. The commit
+    also logs the listings whose price changed during the run (price_changes).
+    After each page, the on_merge callbacks get its new and repriced listings.
+    """
+
+    def __init__(self, pickle_file, new_pickle_file, columns, flush_every=FLUSH_EVERY, started_at=None):
+        self.pickle_file = pickle_file
+        self.new_pickle_file = new_pickle_file
+        self.flush_every = flush_every
+        self.store = PropertyStore.from_frame(load_or_initialize_pickle(pickle_file, columns, STORAGE_BACKEND))
+        self.new_store = PropertyStore.from_frame(load_or_initialize_pickle(new_pickle_file, columns))
+        # Prices before the run, to log the changes it observes. Listings seen since
+        # `started_at` belong to the run (sharded runs merge listings seen before the session)
+        self.started_at = pd.Timestamp.now() if started_at is None else pd.Timestamp(started_at)
+        self._baseline_prices = listing.prices_frame(list(self.store))
+        self.price_changes = storage.price_changes(self._baseline_prices, self._baseline_prices.head(0))
+        self._pages_since_flush = 0
+        # Called after every checkpoint (the crawl journal marks its merged pages as done)
+        self.on_flush = []
+        # Called with (new, repriced) listings after every page (the detail enricher queues them)
+        self.on_merge = []
+        self._lock = threading.Lock()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        self.commit()
+
+    @property
+    def data(self):
+        return self.store.to_frame()
+
+    @property
+    def new_data(self):
+        return self.new_store.to_frame()
+
+    def add(self, extracted_data):
+        """Merge the listings of one page and return the ones not seen before.
+
+        `extracted_data` is usually the generator of a site extractor: its
+        records are deduplicated by key and merged as they are parsed, with no
+        DataFrame per page.
+        """
+        if isinstance(extracted_data, pd.DataFrame):
+            page = listing.from_frame(extracted_data)
+        else:
+            # Runs the extractor; a page is a dozen records
+            page = [listing.as_listing(item) for item in extracted_data]
+        unparseable = [item.ref for item in page if item.price is None and item.extra and "price_text" in item.extra]
+        if unparseable:
+            metrics.count("price_unparseable", len(unparseable))
+            logger.warning(f"Listings without a parseable price: {unparseable}")
+
+        with self._lock:
+            with metrics.timer("merge"):
+                repriced = [
+                    item for item in page
+                    if (previous := self.store.get(item.key)) is not None
+                    and None not in (previous.price, item.price) and previous.price != item.price
+                ]
+                new_properties = self.store.upsert(page)
+                if STORAGE_BACKEND == "sqlite":
+                    # Each page is committed as one batch; checkpoints only rewrite new_properties
+                    storage.database(self.pickle_file).upsert_listings(page)
+                if new_properties:
+                    self.new_store.upsert(new_properties)
+
+            logger.info(f"Number of items: {len(self.store)}")
+
+            self._pages_since_flush += 1
+            if self._pages_since_flush >= self.flush_every:
+                self._flush()
+        for callback in self.on_merge:
+            callback(new_properties, repriced)
+        return new_properties
+
+    def add_details(self, key, details):
+        """Fill the record of listing `key` with the values parsed from its detail page (see ctools.details)."""
+        with self._lock:
+            for store in (self.store, self.new_store):
+                item = store.get(key)
+                if item is not None:
+                    item.add_details(details)
+            if STORAGE_BACKEND == "sqlite" and self.store.get(key) is not None:
+                storage.database(self.pickle_file).upsert_listings([self.store.get(key)])
+
+    def flush(self):
+        """Write a checkpoint of both pickle files."""
+        with self._lock:
+            self._flush()
+
+    def _flush(self):
+        with metrics.timer("persist", "session"):
+            if STORAGE_BACKEND != "sqlite":
+                save_to_pickle(self.store.to_frame(), self.pickle_file, STORAGE_BACKEND)
+            save_to_pickle(self.new_store.to_frame(), self.new_pickle_file)
+        self._pages_since_flush = 0
+        logger.info(f"Checkpoint saved: {len(self.store)} properties, {len(self.new_store)} new.")
+        for callback in self.on_flush:
+            callback()
+
+    def commit(self):
+        """Write the final state of the run and append its price changes to the change log."""
+        self.flush()
+        with self._lock:
+            seen = [item for item in self.store if item.last_seen is not None and item.last_seen >= self.started_at]
+            current = listing.to_frame(seen, self.store.columns)
+            self.price_changes = storage.price_changes(self._baseline_prices, current)
+            storage.append_price_changes(self.price_changes, self.pickle_file)
+            self._baseline_prices = listing.prices_frame(list(self.store))
+
+    def price_drops(self):
+        """Price changes of the run that lowered the price, with the listing's area and URL."""
+        drops = self.price_changes[self.price_changes["change"] < 0]
+        items = [self.store.get(key) for key in zip(drops["inmobiliaria"], drops["ref"])]
+        return drops.assign(area=[item.area for item in items], url=[item.url for item in items])
@@ -0,0 +1,233 @@
+"""Near-duplicate listings: the same flat listed by both agencies, or twice under different refs.
+
+Each listing is reduced to the words of its title and area (lowercase, no
+accents, no filler words like "en" or "venta"), and to a MinHash signature
+of those words. Signatures are cut into BANDS bands (LSH): listings that
+share a band, and whose prices are within PRICE_TOLERANCE, are candidate
+pairs. Candidates come from sorting each band's buckets by price and
+comparing neighbours only, so the work grows with the number of listings,
+not with the number of pairs. A candidate is a duplicate when its estimated
+text similarity reaches TEXT_THRESHOLD, its size (when both have one) is
+within SIZE_TOLERANCE and the numbers of its texts (street numbers, when
+both have them) are the same. Duplicates are grouped with union-find into clusters,
+each with one canonical listing: the first seen.
+"""
+import re
+import unicodedata
+import zlib
+from collections import namedtuple
+
+import numpy as np
+import pandas as pd
+
+from ctools.clogger import logger
+from ctools import listing
+
+
+# MinHash signature length, and how it is cut for LSH: BANDS bands of NUM_PERM // BANDS hashes.
+# 16 bands of 8 find 95% of the pairs with a similarity of 0.8, and 1% of those of 0.4
+NUM_PERM = 128
+BANDS = 16
+# Estimated Jaccard similarity of the title and area words of two duplicates
+TEXT_THRESHOLD = 0.7
+# Relative price difference of two duplicates (agencies round prices differently)
+PRICE_TOLERANCE = 0.05
+# Relative size difference of two duplicates, and the m² always allowed
+SIZE_TOLERANCE = 0.05
+SIZE_SLACK = 2
+# Price neighbours compared within a bucket, at most
+MAX_WINDOW = 200
+# Known listings seen in the last days that make a new duplicate not new
+KNOWN_WITHIN_DAYS = 30
+# Words that say nothing about the flat
+STOPWORDS = {"a", "al", "con", "de", "del", "el", "en", "la", "las", "los", "se", "vende", "venta", "y"}
+
+# Universal hashing (a * x + b) mod a prime above 2**32: a * x + b stays below 2**64
+_PRIME = np.uint64(4294967311)
+_RNG = np.random.default_rng(20240601)
+_A = _RNG.integers(1, 2**32, NUM_PERM, dtype=np.uint64)
+_B = _RNG.integers(0, 2**32, NUM_PERM, dtype=np.uint64)
+# Listings hashed at a time (the permuted hashes of a chunk are NUM_PERM x its words)
+_CHUNK = 5000
+# Candidate pairs checked at a time (each one gathers two signatures)
+_PAIR_CHUNK = 50_000
+
+
+def words(text):
+    """'Dúplex en venta en La Felguera' -> {'duplex', 'felguera'}."""
+    if not isinstance(text, str):
+        return set()
+    text = unicodedata.normalize("NFKD", text.lower()).encode("ascii", "ignore").decode("ascii")
+    return {word for word in re.findall(r"[a-z0-9]+", text) if word not in STOPWORDS}
+
+
+# What is compared between listings: MinHash signatures, prices, sizes and a key of the numbers in their texts
+Features = namedtuple("Features", "signature prices sizes numbers")
+
+
+def features(frame):
+    """Features of the rows of `frame`, by position."""
+    texts = [
+        words(title) | words(area)
+        for title, area in zip(_column(frame, "title"), _column(frame, "area"))
+    ]
+    numbers = np.array([hash(frozenset(word for word in text if word.isdigit())) for text in texts], dtype=np.int64)
+    prices = listing.parse_prices(frame["price"])[0].astype("Float64").to_numpy(dtype=float, na_value=np.nan)
+    sizes = pd.array(_column(frame, "size"), dtype="Float64").to_numpy(dtype=float, na_value=np.nan)
+    return Features(signatures(texts), prices, sizes, numbers)
+
+
+def signatures(texts):
+    """MinHash signatures (len(texts) x NUM_PERM) of sets of words.
+
+    Empty sets get a signature of their own, which matches nothing.
+    """
+    word_hashes = {}
+    signature = np.empty((len(texts), NUM_PERM), dtype=np.uint64)
+    for start in range(0, len(texts), _CHUNK):
+        chunk = texts[start:start + _CHUNK]
+        lengths = np.array([len(text) for text in chunk])
+        hashes = np.fromiter(
+            (word_hashes.setdefault(word, zlib.crc32(word.encode())) for text in chunk for word in text),
+            dtype=np.uint64, count=int(lengths.sum()),
+        )
+        rows = np.arange(start, start + len(chunk))
+        empty = lengths == 0
+        # Beyond the hash range and different for every listing
+        signature[rows[empty]] = _PRIME + rows[empty][:, None].astype(np.uint64)
+        if hashes.size:
+            permuted = (_A[:, None] * hashes[None, :] + _B[:, None]) % _PRIME
+            offsets = np.concatenate([[0], np.cumsum(lengths)[:-1]])[~empty]
+            signature[rows[~empty]] = np.minimum.reduceat(permuted, offsets, axis=1).T
+    return signature
+
+
+def candidate_pairs(signature, prices):
+    """(i, j) arrays, i < j, of listings that share an LSH band and have prices within PRICE_TOLERANCE."""
+    priced = np.flatnonzero(~np.isnan(prices))
+    rows = NUM_PERM // BANDS
+    # Mixes the hashes of a band into one bucket id (wrapping multiplications)
+    mix = np.array([0x9E3779B97F4A7C15 >> shift for shift in range(rows)], dtype=np.uint64)
+    pairs = []
+    with np.errstate(over="ignore"):
+        for band in range(BANDS):
+            buckets = (signature[priced, band * rows:(band + 1) * rows] * mix).sum(axis=1)
+            # By bucket, then by price: the duplicates of a listing are its next few neighbours
+            sort = np.lexsort((prices[priced], buckets))
+            order, bucket, price = priced[sort], buckets[sort], prices[priced][sort]
+            for offset in range(1, MAX_WINDOW + 1):
+                left, right = np.arange(len(order) - offset), np.arange(offset, len(order))
+                close = (bucket[left] == bucket[right]) & (price[right] <= price[left] * (1 + PRICE_TOLERANCE))
+                if not close.any():
+                    break
+                pairs.append(np.sort(np.stack([order[left[close]], order[right[close]]]), axis=0))
+            else:
+                logger.debug(f"Band {band}: price window capped at {MAX_WINDOW} neighbours.")
+    if not pairs:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    # The same pair usually comes from several bands
+    codes = np.unique(np.concatenate([left * len(prices) + right for left, right in pairs]))
+    return codes // len(prices), codes % len(prices)
+
+
+def matches(features, left, right):
+    """Whether listings `left` and `right` (positions, or arrays of them) are duplicates."""
+    signature, prices, sizes, numbers = features
+    similar = (signature[left] == signature[right]).mean(axis=-1) >= TEXT_THRESHOLD
+    price_ok = np.abs(prices[left] - prices[right]) <= PRICE_TOLERANCE * np.fmax(prices[left], prices[right])
+    size_gap = np.abs(sizes[left] - sizes[right])
+    size_ok = np.isnan(size_gap) | (size_gap <= np.maximum(SIZE_SLACK, SIZE_TOLERANCE * np.fmax(sizes[left], sizes[right])))
+    # Calle Dorado 3 is not Calle Dorado 5; texts without numbers share the same key
+    numbers_ok = numbers[left] == numbers[right]
+    no_numbers = hash(frozenset())
+    numbers_ok |= (numbers[left] == no_numbers) | (numbers[right] == no_numbers)
+    return similar & price_ok & size_ok & numbers_ok
+
+
+def cluster(frame):
+    """Cluster label of each row of `frame` (the position of its canonical row), as a Series.
+
+    `frame` needs price, and should have title, area and size; first_seen
+    decides the canonical listing of a cluster when present.
+    """
+    frame = frame.reset_index(drop=True)
+    labels = np.arange(len(frame))
+    if frame.empty:
+        return pd.Series(labels, dtype=np.int64)
+
+    compared = features(frame)
+    prices = compared.prices
+    left, right = candidate_pairs(compared.signature, prices)
+
+    matched = np.concatenate([
+        matches(compared, left[start:start + _PAIR_CHUNK], right[start:start + _PAIR_CHUNK])
+        for start in range(0, len(left), _PAIR_CHUNK)
+    ]) if len(left) else np.zeros(0, dtype=bool)
+    logger.info(f"Duplicates: {len(left)} candidate pairs for {len(frame)} listings, {int(matched.sum())} confirmed.")
+
+    # Union-find, with the first seen listing (then the first row) as the root of each cluster.
+    # Two clusters only merge when their roots match too, so generic titles do not chain
+    # listings of drifting prices and sizes into one cluster. Closest prices merge first.
+    first_seen = pd.to_datetime(_column(frame, "first_seen")).to_numpy(dtype="datetime64[ns]")
+    rank = np.lexsort((np.arange(len(frame)), first_seen))
+    position = np.empty(len(frame), dtype=np.int64)
+    position[rank] = np.arange(len(frame))
+    parent = labels.copy()
+
+    def root(node):
+        while parent[node] != node:
+            parent[node] = parent[parent[node]]
+            node = parent[node]
+        return node
+
+    left, right = left[matched], right[matched]
+    closest = np.argsort(np.abs(prices[left] - prices[right]), kind="stable")
+    for a, b in zip(left[closest], right[closest]):
+        a, b = root(a), root(b)
+        if a != b and matches(compared, a, b):
+            if position[b] < position[a]:
+                a, b = b, a
+            parent[b] = a
+    return pd.Series([root(node) for node in labels], dtype=np.int64)
+
+
+def collapse_new(new_properties, history, now=None):
+    """New properties without duplicates: one row per cluster, with the other listings' URLs in `also_at`.
+
+    New listings that duplicate a listing of `history` seen in the last
+    KNOWN_WITHIN_DAYS are not new, and are left out. `history` is the whole
+    store (new listings included), as PropertySession.data returns it.
+    """
+    if new_properties is None or new_properties.empty:
+        return new_properties
+    history = history.reset_index(drop=True)
+    labels = cluster(history)
+    keys = pd.MultiIndex.from_frame(history[["inmobiliaria", "ref"]].astype(str))
+    new_keys = pd.MultiIndex.from_frame(new_properties[["inmobiliaria", "ref"]].astype(str))
+    is_new = keys.isin(new_keys)
+
+    now = pd.Timestamp.now() if now is None else now
+    last_seen = pd.to_datetime(_column(history, "last_seen"))
+    recent = ~is_new & (last_seen >= now - pd.Timedelta(days=KNOWN_WITHIN_DAYS))
+    known_clusters = set(labels[recent])
+
+    new_rows = history[is_new].assign(cluster=labels[is_new])
+    duplicates_of_known = new_rows["cluster"].isin(known_clusters)
+    # The first seen new listing of each cluster stands for the others
+    new_rows = new_rows[~duplicates_of_known].sort_values(["cluster", "first_seen"], kind="stable")
+    also_at = new_rows.groupby("cluster")["url"].agg(lambda urls: " ".join(str(url) for url in urls.iloc[1:]))
+    kept = new_rows.drop_duplicates("cluster")
+    kept_keys = pd.MultiIndex.from_frame(kept[["inmobiliaria", "ref"]].astype(str))
+
+    collapsed = new_properties[new_keys.isin(kept_keys)].copy()
+    url_by_key = dict(zip(kept_keys, kept["cluster"].map(also_at)))
+    collapsed["also_at"] = [url_by_key.get(key, "") for key in new_keys[new_keys.isin(kept_keys)]]
+    logger.info(
+        f"{len(new_properties)} new properties: {int(duplicates_of_known.sum())} repeat known ones, "
+        f"{len(new_rows) - len(kept)} repeat other new ones, {len(collapsed)} left."
+    )
+    return collapsed
+
+
+def _column(frame, name):
+    return frame[name] if name in frame else pd.Series([None] * len(frame), index=frame.index)
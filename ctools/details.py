@@ -0,0 +1,221 @@
+"""Detail-page enrichment: size, rooms, location and photos of the listings that need them.
+
+Result pages only give ref, price and a short description. After each page is
+merged, PropertySession hands its new and repriced listings to a
+DetailEnricher (session.on_merge), which queues their detail pages by
+priority: new listings first, then repriced ones, the cheapest first. The
+engine fetches them alongside the crawl, at most DETAIL_CONCURRENCY at a time
+and DETAIL_MAX_PAGES per run, and each site's extract_details parses them.
+
+Parsed details are kept in a SQLite file (results/details.sqlite) keyed by
+(inmobiliaria, ref), so no detail page is fetched twice: a listing seen again
+gets its details from there. Pages left over by the per-run limit, or that
+failed, stay queued for the next run, up to DETAIL_MAX_ATTEMPTS attempts.
+"""
+import heapq
+import itertools
+import json
+import math
+import os
+import re
+import sqlite3
+import threading
+from collections import Counter
+from datetime import datetime
+from urllib.parse import urljoin
+
+from ctools.clogger import logger
+from ctools import metrics
+
+
+DETAILS_PATH = 'results/details.sqlite'
+# Detail pages being fetched at the same time, all sites together (the crawl keeps the other workers)
+DETAIL_CONCURRENCY = 2
+# Detail pages fetched per run; the rest wait for the next run
+DETAIL_MAX_PAGES = 150
+# Attempts on a detail page (across runs) before it is given up
+DETAIL_MAX_ATTEMPTS = 3
+# Queue priorities: lower goes first
+NEW, REPRICED = 0, 1
+
+PENDING, DONE = "pending", "done"
+
+# Rooms in a detail page text: "3 habitaciones", "2 dormitorios", "Habitaciones: 3"
+ROOMS_RE = re.compile(r"(\d+)\s*(?:habitaci|dormitori)|(?:habitaciones|dormitorios)\s*:?\s*(\d+)", re.IGNORECASE)
+# Photo links and sources
+IMAGE_RE = re.compile(r"\.(?:jpe?g|png|webp)(?:\?|$)", re.IGNORECASE)
+
+
+def parse_rooms(text):
+    """'3 habitaciones' or 'Dormitorios: 3' -> 3; None when the text has no rooms."""
+    match = ROOMS_RE.search(text or "")
+    return int(match.group(1) or match.group(2)) if match else None
+
+
+def photo_urls(elements, base_url):
+    """Absolute URLs of the images inside `elements`, in page order, without repeats.
+
+    Galleries usually link the full photos from their thumbnails: the links
+    are taken when there are any, the images shown otherwise.
+    """
+    nodes = [node for element in elements for node in element.iter()]
+    for attributes in (("href",), ("data-src", "data-lazy-src", "src")):
+        urls = [
+            urljoin(base_url, value.strip())
+            for node in nodes for value in map(node.get, attributes)
+            if value and IMAGE_RE.search(value)
+        ]
+        if urls:
+            return list(dict.fromkeys(urls))
+    return []
+
+
+class DetailEnricher:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS details (
+        inmobiliaria TEXT NOT NULL,
+        ref TEXT NOT NULL,
+        url TEXT,
+        status TEXT NOT NULL,
+        priority INTEGER NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT NOT NULL,
+        details TEXT,
+        PRIMARY KEY (inmobiliaria, ref)
+    );
+    """
+
+    def __init__(self, session, sites, path=DETAILS_PATH, concurrency=DETAIL_CONCURRENCY,
+                 max_pages=DETAIL_MAX_PAGES, max_attempts=DETAIL_MAX_ATTEMPTS):
+        self.session = session
+        # Only the sites that can parse their detail pages
+        self.sites = {site.name: site for site in sites if site.extract_details}
+        self.concurrency = concurrency
+        self.max_pages = max_pages
+        self.max_attempts = max_attempts
+        self.in_flight = 0
+        self.stats = Counter()
+        # Heap of (priority, price, order, key); `queued` holds every key handled in this run
+        self._queue = []
+        self._order = itertools.count()
+        self._queued = set()
+        # Priority of the pages in flight, kept if they fail
+        self._priorities = {}
+        self._lock = threading.Lock()
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.executescript(self.SCHEMA)
+
+        # Pages left over by earlier runs go first, at their own priority
+        left_over = self.connection.execute(
+            "SELECT inmobiliaria, ref, priority FROM details WHERE status = ? AND attempts < ? ORDER BY updated_at",
+            (PENDING, self.max_attempts),
+        ).fetchall()
+        for inmobiliaria, ref, priority in left_over:
+            item = session.store.get((inmobiliaria, ref))
+            if item is not None and inmobiliaria in self.sites:
+                self._push(item, priority)
+        session.on_merge.append(self.push)
+
+    def _now(self):
+        return datetime.now().isoformat(timespec="seconds")
+
+    def _push(self, item, priority):
+        self._queued.add(item.key)
+        price = item.price if item.price is not None else math.inf
+        heapq.heappush(self._queue, (priority, price, next(self._order), item.key))
+
+    def cached(self, key):
+        """Details parsed earlier for the listing `key`, or None."""
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT details FROM details WHERE inmobiliaria = ? AND ref = ? AND status = ?", (*key, DONE)
+            ).fetchone()
+        return json.loads(row[0]) if row else None
+
+    def push(self, new_listings, repriced):
+        """Queue the detail pages of the new and repriced listings of a page (PropertySession.on_merge)."""
+        for priority, items in ((NEW, new_listings), (REPRICED, repriced)):
+            for item in items:
+                if item.inmobiliaria not in self.sites or item.key in self._queued:
+                    continue
+                details = self.cached(item.key)
+                if details is not None:
+                    self._queued.add(item.key)
+                    self.session.add_details(item.key, details)
+                    self.stats["cached"] += 1
+                    with metrics.site(item.inmobiliaria):
+                        metrics.count("detail_cache_hit")
+                    continue
+                self._push(item, priority)
+
+    def next_pages(self):
+        """(site, key, url) of the detail pages to fetch now: the most urgent, while fewer than `concurrency` are in flight."""
+        pages = []
+        while self._queue and self.in_flight < self.concurrency and self.stats["started"] < self.max_pages:
+            priority, _, _, key = heapq.heappop(self._queue)
+            item = self.session.store.get(key)
+            if item is None:
+                continue
+            site = self.sites[key[0]]
+            url = self.detail_url(site, item)
+            if not url:
+                continue
+            self.in_flight += 1
+            self.stats["started"] += 1
+            self._priorities[key] = priority
+            pages.append((site, key, url))
+        return pages
+
+    def detail_url(self, site, item):
+        """URL of the detail page of `item`: the one of its result card (a card's ref is not always the code in its URL)."""
+        return item.url
+
+    def fetched(self, key, url, details):
+        """Record the details parsed from the detail page of `key` (None when it failed) and fill its listing.
+
+        A page where nothing was found (a wrong page, or one not rendered yet)
+        counts as a failed attempt, not as done.
+        """
+        self.in_flight -= 1
+        priority = self._priorities.pop(key, NEW)
+        if details is not None and all(value is None or value in ("", []) for value in details.values()):
+            logger.warning(f"Nothing found on the detail page {url}.")
+            details = None
+        with self._lock, self.connection:
+            if details is None:
+                self.connection.execute(
+                    "INSERT INTO details (inmobiliaria, ref, url, status, priority, attempts, updated_at) VALUES (?, ?, ?, ?, ?, 1, ?) "
+                    "ON CONFLICT (inmobiliaria, ref) DO UPDATE SET attempts = attempts + 1, updated_at = excluded.updated_at",
+                    (*key, url, PENDING, priority, self._now()),
+                )
+            else:
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO details VALUES (?, ?, ?, ?, ?, 0, ?, ?)",
+                    (*key, url, DONE, priority, self._now(), json.dumps(details, ensure_ascii=False)),
+                )
+        if details is None:
+            self.stats["failed"] += 1
+            return
+        self.session.add_details(key, details)
+        self.stats["fetched"] += 1
+
+    def finish(self):
+        """Keep the pages still queued for the next run; returns the run's counts."""
+        left = [(key, priority) for priority, _, _, key in self._queue]
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "INSERT INTO details (inmobiliaria, ref, status, priority, updated_at) VALUES (?, ?, ?, ?, ?) "
+                "ON CONFLICT (inmobiliaria, ref) DO UPDATE SET priority = excluded.priority",
+                [(*key, PENDING, priority, self._now()) for key, priority in left],
+            )
+        self._queue = []
+        self.stats["left"] = len(left)
+        logger.info(
+            f"Detail pages: {self.stats['fetched']} fetched, {self.stats['cached']} from the cache, "
+            f"{self.stats['failed']} failed, {len(left)} left for the next run."
+        )
+        return dict(self.stats)
@@ -1,122 +1,164 @@
-import pandas as pd
-import smtplib
-from email.mime.text import MIMEText
-from email.mime.multipart import MIMEMultipart
-import pandas as pd
-import os
-
-from ctools import time_lapse
-from ctools.clogger import logger
-
-
-SEND_EMAILS = True
-HEALTH_EMAIL_SEND_INTERVAL_DAYS=2
-
-
-def emailing(df, new_properties_path, sender_email, receiver_email, password):
-    if not df.empty:
-        logger.info(f'{len(df)} new properties are available. Sending email...')
-        # aws.upload_file_to_s3(bucket_name, properties_path, s3_key)
-        subject, body = get_email_content(new_properties_path)
-        send_email(sender_email, receiver_email, password, subject, body)
-    else:
-        last_email_days = time_lapse.days_since_last_email()
-        if last_email_days > HEALTH_EMAIL_SEND_INTERVAL_DAYS:
-            send_health_reminder(sender_email, receiver_email, password, last_email_days)
-        else:
-            logger.info("No new properties are available. Email won't be sent.")
-
-
-
-
-
-def get_email_content(file_path):
-    
-    # Cargar el DataFrame
-    df = pd.read_pickle(file_path)
-    
-    # Verificar si hay datos
-    if df.empty:
-        subject = "Actualización: No hay nuevas viviendas disponibles"
-        body = "<p>No se han registrado nuevas viviendas en el sistema en el último lote de datos.</p>"
-        return subject, body
-    
-    # Generar subject
-    num_viviendas = len(df)
-    subject = f"Actualización: {num_viviendas} nuevas viviendas disponibles"
-    
-    # Generar resumen en formato HTML
-    resumen = df.to_html(index=False, border=1, classes="dataframe", justify="center")
-    
-    # Crear un cuerpo de correo con HTML completo
-    body = f"""
-    <html>
-    <head>
-    <style>
-        table {{
-            width: 100%;
-            border-collapse: collapse;
-        }}
-        th, td {{
-            border: 1px solid black;
-            padding: 8px;
-            text-align: center;
-        }}
-        .dataframe th {{
-            background-color: #f2f2f2;
-        }}
-    </style>
-    </head>
-    <body>
-        <p>Estimado equipo,</p>
-        <p>Se han registrado {num_viviendas} nuevas viviendas en el sistema. Adjunto los datos a continuación:</p>
-        {resumen}
-        <p>Un saludo! Nos vemos pronto.</p>
-    </body>
-    </html>
-    """
-    
-    return subject, body
-
-
-
-
-def send_email(sender_email, receiver_email, password, subject, body):
-    if SEND_EMAILS:
-        # Create the email message
-        message = MIMEMultipart()
-        message["From"] = sender_email
-        message["To"] = receiver_email
-        message["Subject"] = subject
-        message.attach(MIMEText(body, "html"))
-
-        receiver_email_list = receiver_email.split(',')
-
-        try:
-            # Connect to the SMTP server and send the email
-            with smtplib.SMTP("smtp.gmail.com", 587) as server:
-                server.starttls()  # Enable TLS encryption
-                server.login(sender_email, password)  # Log in to the SMTP server
-                server.sendmail(sender_email, receiver_email_list, message.as_string())  # Send the email
-                logger.info("Correo enviado con éxito")
-                time_lapse.update_last_email_date()
-        except Exception as e:
-            logger.error(f"Error al enviar el correo: {e}")
-    else:
-        logger.info("Email would be sent but SEND_EMAILS is set on False to avoid spaming, email won't be sent")
-
-
-def send_health_reminder(sender_email, receiver_email, password, last_email_days):
-    # Health reminder
-    subject = "SCRAPER - Sin viviendas nuevas"
-    html_body = f"""
-    <html>
-        <body>
-            <p>Hola!</p>
-            <p>Sigo scrapeando las webs pero no ha habido viviendas en los últimos <strong>{last_email_days} días</strong>.</p>
-            <p>Escribiré de nuevo en <strong>7 días</strong> o cuando aparezcan nuevas viviendas.</p>
-            <p>Nos vemos!</p>
-        </body>
-    </html>
-    """
+import pandas as pd
+import smtplib
+from email.mime.text import MIMEText
+from email.mime.multipart import MIMEMultipart
+import pandas as pd
+import os
+
+from ctools import time_lapse
+from ctools import filters
+from ctools.clogger import logger
+
+
+SEND_EMAILS = True
+HEALTH_EMAIL_SEND_INTERVAL_DAYS=2
+
+
+def emailing(df, new_properties_path, sender_email, receiver_email, password, price_drops=None):
+    # One email per user, with the listings within their budget and areas (see filters.py)
+    sent = False
+    for user in filters.load_filters(receiver_email):
+        user_df = filters.apply(df, user)
+        user_drops = filters.apply(price_drops, user)
+        num_drops = 0 if user_drops is None else len(user_drops)
+        if user_df.empty and not num_drops:
+            logger.info(f"Nothing within the filters of {user.email}.")
+            continue
+        logger.info(f'{len(user_df)} new properties and {num_drops} price drops for {user.email}. Sending email...')
+        # aws.upload_file_to_s3(bucket_name, properties_path, s3_key)
+        subject, body = get_email_content(new_properties_path, user_drops, user)
+        send_email(sender_email, user.email, password, subject, body)
+        sent = True
+
+    if not sent:
+        last_email_days = time_lapse.days_since_last_email()
+        if last_email_days > HEALTH_EMAIL_SEND_INTERVAL_DAYS:
+            send_health_reminder(sender_email, receiver_email, password, last_email_days)
+        else:
+            logger.info("No new properties are available. Email won't be sent.")
+
+
+
+
+
+def format_euros(prices):
+    """Integer euros, shown as the sites print them: 45.000"""
+    return prices.map(lambda price: "" if pd.isna(price) else f"{int(price):,}".replace(",", "."))
+
+
+def price_drops_section(price_drops):
+    """HTML section with the listings whose price went down, biggest drop first."""
+    if price_drops is None or price_drops.empty:
+        return ""
+    drops = price_drops.sort_values("change").reindex(columns=["ref", "inmobiliaria", "area", "old_price", "price", "change", "url"])
+    drops = drops.dropna(axis="columns", how="all")
+    for column in ["old_price", "price", "change"]:
+        drops[column] = format_euros(drops[column])
+    tabla = drops.to_html(index=False, border=1, classes="dataframe", justify="center")
+    return f"""
+        <p>Han bajado de precio {len(drops)} viviendas:</p>
+        {tabla}"""
+
+
+def get_email_content(file_path, price_drops=None, user=None):
+    
+    # Cargar el DataFrame (solo las viviendas dentro de los filtros del usuario)
+    df = pd.read_pickle(file_path)
+    if user is not None:
+        df = filters.apply(df, user)
+    bajadas = price_drops_section(price_drops)
+    
+    # Verificar si hay datos
+    if df.empty and not bajadas:
+        subject = "Actualización: No hay nuevas viviendas disponibles"
+        body = "<p>No se han registrado nuevas viviendas en el sistema en el último lote de datos.</p>"
+        return subject, body
+    
+    # Generar subject
+    num_viviendas = len(df)
+    subject = f"Actualización: {num_viviendas} nuevas viviendas disponibles"
+    if bajadas:
+        subject += f", {len(price_drops)} bajadas de precio"
+    
+    # Generar resumen en formato HTML (sin las columnas internas de seguimiento ni las URLs de las fotos)
+    df = df.drop(columns=["first_seen", "last_seen", "photos"], errors="ignore")
+    if "price" in df and pd.api.types.is_numeric_dtype(df["price"]):
+        df["price"] = format_euros(df["price"])
+    resumen = ""
+    if num_viviendas:
+        tabla = df.to_html(index=False, border=1, classes="dataframe", justify="center")
+        resumen = f"""<p>Se han registrado {num_viviendas} nuevas viviendas en el sistema. Adjunto los datos a continuación:</p>
+        {tabla}"""
+    
+    # Crear un cuerpo de correo con HTML completo
+    body = f"""
+    <html>
+    <head>
+    <style>
+        table {{
+            width: 100%;
+            border-collapse: collapse;
+        }}
+        th, td {{
+            border: 1px solid black;
+            padding: 8px;
+            text-align: center;
+        }}
+        .dataframe th {{
+            background-color: #f2f2f2;
+        }}
+    </style>
+    </head>
+    <body>
+        <p>Estimado equipo,</p>
+        {resumen}
+        {bajadas}
+        <p>Un saludo! Nos vemos pronto.</p>
+    </body>
+    </html>
+    """
+    
+    return subject, body
+
+
+
+
+def send_email(sender_email, receiver_email, password, subject, body):
+    if SEND_EMAILS:
+        # Create the email message
+        message = MIMEMultipart()
+        message["From"] = sender_email
+        message["To"] = receiver_email
+        message["Subject"] = subject
+        message.attach(MIMEText(body, "html"))
+
+        receiver_email_list = receiver_email.split(',')
+
+        try:
+            # Connect to the SMTP server and send the email
+            with smtplib.SMTP("smtp.gmail.com", 587) as server:
+                server.starttls()  # Enable TLS encryption
+                server.login(sender_email, password)  # Log in to the SMTP server
+                server.sendmail(sender_email, receiver_email_list, message.as_string())  # Send the email
+                logger.info("Correo enviado con éxito")
+                time_lapse.update_last_email_date()
+        except Exception as e:
+            logger.error(f"Error al enviar el correo: {e}")
+    else:
+        logger.info("Email would be sent but SEND_EMAILS is set on False to avoid spaming, email won't be sent")
+
+
+def send_health_reminder(sender_email, receiver_email, password, last_email_days):
+    # Health reminder
+    subject = "SCRAPER - Sin viviendas nuevas"
+    html_body = f"""
+    <html>
+        <body>
+            <p>Hola!</p>
+            <p>Sigo scrapeando las webs pero no ha habido viviendas en los últimos <strong>{last_email_days} días</strong>.</p>
+            <p>Escribiré de nuevo en <strong>7 días</strong> o cuando aparezcan nuevas viviendas.</p>
+            <p>Nos vemos!</p>
+        </body>
+    </html>
+    """
     send_email(sender_email, receiver_email, password, subject, html_body)
\ No newline at end of file
@@ -0,0 +1,209 @@
+"""Shared crawl engine for every registered site (see ctools.sites).
+
+All searches of all sites go through one work queue: the page counts of every
+search are requested first, then their result pages, so a slow site (the
+browser-rendered one) overlaps with the fast ones instead of running after
+them. HostRateLimiter still limits each host on its own. Pages are merged into
+the property session on the calling thread, in page order within each search,
+which is what lets a newest-first search stop at the first known listings.
+
+Every search and page goes through a crawl journal (see ctools.journal): a
+resumed run reuses the page lists of its searches and only fetches the pages
+that are not done yet.
+
+With a DetailEnricher (see ctools.details), the detail pages of the new and
+repriced listings are fetched through the same queue as the crawl goes, a few
+at a time, the most urgent first.
+"""
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+from ctools.clogger import logger
+from ctools import cscrap
+from ctools import journal as crawl_journal
+from ctools import metrics
+from ctools import sites as site_registry
+
+
+class Crawl:
+    """Result pages of one search, fetched in waves and processed in page order."""
+
+    def __init__(self, site, urls, early_stop, stop_after=cscrap.EARLY_STOP_PAGES, journal=None):
+        self.site = site
+        self.urls = urls
+        self.journal = journal
+        self.early_stop = early_stop
+        self.stop_after = stop_after
+        self.submitted = 0
+        self.processed = 0
+        self.pages = {}
+        self.pages_without_new = 0
+        self.stopped = False
+
+    def next_wave(self):
+        """Indexes of the pages to fetch next: all of them, or `stop_after` at a time when stopping early."""
+        if self.stopped or self.submitted > self.processed:
+            return range(0)
+        size = self.stop_after if self.early_stop else len(self.urls)
+        wave = range(self.submitted, min(self.submitted + size, len(self.urls)))
+        self.submitted = wave.stop
+        return wave
+
+    def process(self, session):
+        """Merge every downloaded page that is next in order into `session`."""
+        while not self.stopped and self.processed in self.pages:
+            page_source = self.pages.pop(self.processed)
+            self.processed += 1
+            logger.info('-' * 100)
+            logger.info(f"Scraping {self.site.name} page {self.processed}/{len(self.urls)}...")
+            if page_source is None:
+                continue
+
+            with metrics.site(self.site.name):
+                new_properties = session.add(self.site.extract(page_source))
+                metrics.count("pages")
+            if self.journal:
+                self.journal.page_processed(self.urls[self.processed - 1])
+            self.pages_without_new = 0 if len(new_properties) else self.pages_without_new + 1
+            if self.early_stop and self.pages_without_new >= self.stop_after:
+                logger.info(f"No unseen listings in the last {self.stop_after} pages. Stopping after page {self.processed}/{len(self.urls)}.")
+                self.stopped = True
+                if self.journal:
+                    self.journal.pages_skipped(self.urls[self.processed:])
+
+
+def run(session, sites=None, full_sweep=True, pool_size=cscrap.POOL_SIZE, throttle=cscrap.THROTTLE, journal=None,
+        enricher=None):
+    """Scrape every search of `sites` (all registered sites by default) into `session`.
+
+    Unless `full_sweep` is set, newest-first sites stop once only known listings appear.
+    `journal` is a started CrawlJournal; without one, the run keeps an in-memory journal.
+    `enricher` is a DetailEnricher of `session`; without one, no detail page is fetched.
+    """
+    sites = site_registry.all_sites() if sites is None else sites
+    if journal is None:
+        journal = crawl_journal.CrawlJournal(":memory:")
+        journal.start(full_sweep)
+    if journal.checkpoint not in session.on_flush:
+        session.on_flush.append(journal.checkpoint)
+    # One set of warm browsers for the whole run, shared by every site that renders pages
+    browsers = cscrap.DriverPool(pool_size)
+    fetchers = {site.name: cscrap.get_fetcher(site.fetcher, pool_size, browsers) for site in sites}
+    pending = {}
+
+    def submit(function, *args, then, **kwargs):
+        pending[executor.submit(function, *args, **kwargs)] = then
+
+    def fetch_page(site, url):
+        with metrics.site(site.name):
+            return cscrap.save_html(fetchers[site.name], url, wait_for=site.wait_for, throttle=throttle)
+
+    def count_pages(site, first_page_url, page_template):
+        with metrics.site(site.name):
+            return site_registry.list_pages(site, fetchers[site.name], first_page_url, page_template)
+
+    def fetch_details(site, url):
+        with metrics.site(site.name):
+            page_source = cscrap.save_html(fetchers[site.name], url, wait_for=site.detail_wait_for, throttle=throttle)
+            return site.extract_details(page_source, url) if page_source else None
+
+    def start_details():
+        if enricher is None:
+            return
+        for site, key, url in enricher.next_pages():
+            submit(
+                fetch_details, site, url,
+                then=lambda future, key=key, url=url: details_fetched(key, url, future),
+            )
+
+    def details_fetched(key, url, future):
+        try:
+            details = future.result()
+        except Exception as e:
+            logger.error(f"Error reading the detail page {url}: {e}")
+            details = None
+        enricher.fetched(key, url, details)
+        start_details()
+
+    def fetch_wave(crawl):
+        skipped = False
+        for index in crawl.next_wave():
+            url = crawl.urls[index]
+            if not journal.should_fetch(url):
+                # Done before the run was interrupted (or given up): nothing to fetch or merge
+                crawl.pages[index] = None
+                skipped = True
+                continue
+            journal.page_started(url)
+            submit(
+                fetch_page, crawl.site, url,
+                then=lambda future, crawl=crawl, index=index: page_fetched(crawl, index, future),
+            )
+        if skipped:
+            crawl.process(session)
+            fetch_wave(crawl)
+
+    def start_crawl(site, first_page_url, urls):
+        crawl = Crawl(site, urls, early_stop=not full_sweep and site.newest_first, journal=journal)
+        fetch_wave(crawl)
+
+    def pages_listed(site, first_page_url, future):
+        try:
+            urls = future.result()
+        except Exception:
+            journal.search_failed(site.name, first_page_url)
+            raise
+        logger.info(f"{site.name}: {len(urls)} pages for {first_page_url}")
+        journal.list_pages(site.name, first_page_url, urls)
+        start_crawl(site, first_page_url, urls)
+
+    def page_fetched(crawl, index, future):
+        crawl.pages[index] = future.result()
+        if crawl.pages[index] is None and not crawl.stopped:
+            journal.page_failed(crawl.urls[index])
+        crawl.process(session)
+        fetch_wave(crawl)
+        start_details()
+
+    try:
+        with ThreadPoolExecutor(max_workers=pool_size * len(sites)) as executor:
+            for site in sites:
+                for first_page_url, page_template in site.searches():
+                    urls = journal.listed_pages(site.name, first_page_url)
+                    if urls is not None:
+                        logger.info(f"{site.name}: resuming {len(urls)} pages for {first_page_url}")
+                        start_crawl(site, first_page_url, urls)
+                        continue
+                    if not journal.should_list(site.name, first_page_url):
+                        continue
+                    submit(
+                        count_pages, site, first_page_url, page_template,
+                        then=lambda future, site=site, first_page_url=first_page_url: pages_listed(site, first_page_url, future),
+                    )
+
+            # Detail pages left over by the last run
+            start_details()
+
+            while pending:
+                done, _ = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    then = pending.pop(future)
+                    try:
+                        then(future)
+                    except Exception as e:
+                        logger.error(f'Excepcion: {e}')
+    finally:
+        for fetcher in fetchers.values():
+            fetcher.close()
+        browsers.quit()
+
+
+def scrap(sites=None, session=None, full_sweep=None):
+    """Run the engine on `sites`, in `session` or in a session of its own on results/properties.pkl."""
+    if full_sweep is None:
+        full_sweep = cscrap.full_sweep_due()
+    if session is None:
+        properties_path = 'results/properties.pkl'
+        new_properties_path = 'results/new_properties.pkl'
+        with cscrap.PropertySession(properties_path, new_properties_path, site_registry.COLUMNS) as session:
+            return run(session, sites, full_sweep)
+    return run(session, sites, full_sweep)
@@ -0,0 +1,82 @@
+"""Per-user post-filters on the typed listing columns: budget and areas.
+
+Filters run on whole DataFrames (new properties, price drops) as vectorized
+masks, never row by row. Each user is a UserFilter, read from the
+USER_FILTERS environment variable as a JSON object keyed by email:
+
+    {"ana@example.com": {"max_price": 60000, "areas": ["La Felguera", "Sama"]},
+     "luis@example.com": {"min_price": 30000, "max_price": 75000}}
+
+Without USER_FILTERS, the single EMAIL_RECEIVER gets everything, as before.
+Listings with no price or no area (the card did not show it) are kept unless
+keep_unpriced or keep_unlocated is false.
+"""
+import json
+import os
+import re
+from collections import namedtuple
+
+import pandas as pd
+
+from ctools.clogger import logger
+from ctools import listing
+
+
+# Environment variable with the users and their filters (JSON)
+FILTERS_ENV = "USER_FILTERS"
+
+# email: recipients (comma-separated, as EMAIL_RECEIVER); prices in integer euros;
+# areas: texts matched against the `area` column; keep_unpriced: keep listings with no price ("Consultar");
+# keep_unlocated: keep listings with no area when filtering by areas
+UserFilter = namedtuple(
+    "UserFilter", "email min_price max_price areas keep_unpriced keep_unlocated", defaults=(None, None, (), True, True)
+)
+
+
+def load_filters(receiver_email=None, config=None):
+    """UserFilters of `config` (JSON text, USER_FILTERS by default), or one unfiltered receiver_email."""
+    config = os.getenv(FILTERS_ENV) if config is None else config
+    if not config:
+        return [UserFilter(receiver_email)] if receiver_email else []
+    users = []
+    for email, options in json.loads(config).items():
+        # A misspelled option skips that user only, not the emails of everyone else
+        unknown = set(options) - set(UserFilter._fields[1:])
+        if unknown:
+            logger.warning(f"Filter of {email} skipped: unknown options {sorted(unknown)}.")
+            continue
+        users.append(UserFilter(email, **options))
+    logger.info(f"Filters of {len(users)} users loaded from {FILTERS_ENV}.")
+    return users
+
+
+def mask(dataframe, user):
+    """Boolean Series: the rows of `dataframe` within `user`'s budget and areas."""
+    keep = pd.Series(True, index=dataframe.index)
+    if dataframe.empty:
+        return keep
+
+    if user.min_price is not None or user.max_price is not None:
+        prices = listing.parse_prices(dataframe["price"])[0]
+        in_budget = pd.Series(True, index=dataframe.index, dtype="boolean")
+        if user.min_price is not None:
+            in_budget &= prices >= user.min_price
+        if user.max_price is not None:
+            in_budget &= prices <= user.max_price
+        # No price: in budget or not, depending on keep_unpriced
+        keep &= in_budget.fillna(user.keep_unpriced).astype(bool)
+
+    if user.areas:
+        areas = dataframe["area"] if "area" in dataframe else pd.Series(pd.NA, index=dataframe.index)
+        areas = areas.astype("string").str.strip().replace("", pd.NA)
+        pattern = "|".join(re.escape(area) for area in user.areas)
+        # No area: in the areas or not, depending on keep_unlocated
+        keep &= areas.str.contains(pattern, case=False).astype("boolean").fillna(user.keep_unlocated).astype(bool)
+    return keep
+
+
+def apply(dataframe, user):
+    """The rows of `dataframe` that pass `user`'s filter (None stays None)."""
+    if dataframe is None:
+        return None
+    return dataframe[mask(dataframe, user)]
@@ -0,0 +1,163 @@
+"""Lease-based job queue in SQLite, to shard a crawl across worker processes or machines.
+
+A crawl run is expanded into jobs: one "search" job per search of every
+site, which lists its result pages and enqueues one "page" job per page.
+Any number of workers (see shard.py) claim jobs with a lease: a job whose
+worker dies is claimed again once its lease expires, up to JOB_MAX_ATTEMPTS
+times. Claims run in BEGIN IMMEDIATE transactions, so workers only need to
+share the database file (a local disk, or a shared volume for several
+machines), not a server. The queue keeps SQLite's rollback journal: WAL
+needs shared memory on one host and does not work over network filesystems.
+"""
+import os
+import sqlite3
+import time
+from collections import namedtuple
+from datetime import datetime
+
+from ctools.clogger import logger
+from ctools import storage
+
+
+QUEUE_PATH = 'results/jobs.sqlite'
+# Seconds a worker holds a job before other workers may claim it again
+JOB_LEASE_SECONDS = 300
+# Claims of a job before it is given up (expired leases and failures)
+JOB_MAX_ATTEMPTS = 3
+
+QUEUED, LEASED, DONE, FAILED = "queued", "leased", "done", "failed"
+
+Job = namedtuple("Job", "job_id run_id kind site search template url page attempts")
+
+
+class JobQueue:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS runs (
+        run_id TEXT PRIMARY KEY,
+        started_at TEXT NOT NULL,
+        reduced_at TEXT
+    );
+    CREATE TABLE IF NOT EXISTS jobs (
+        job_id INTEGER PRIMARY KEY,
+        run_id TEXT NOT NULL,
+        kind TEXT NOT NULL,
+        site TEXT NOT NULL,
+        search TEXT NOT NULL,
+        template TEXT,
+        url TEXT,
+        page INTEGER,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        worker TEXT,
+        lease_expires REAL,
+        UNIQUE (run_id, kind, site, search, url)
+    );
+    CREATE INDEX IF NOT EXISTS jobs_by_status ON jobs (run_id, status);
+    """
+
+    def __init__(self, path=QUEUE_PATH, lease_seconds=JOB_LEASE_SECONDS, max_attempts=JOB_MAX_ATTEMPTS):
+        self.path = path
+        self.lease_seconds = lease_seconds
+        self.max_attempts = max_attempts
+        if os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        # Autocommit: every write below opens its own BEGIN IMMEDIATE transaction
+        self.connection = sqlite3.connect(path, isolation_level=None, timeout=30)
+        self.connection.execute("PRAGMA journal_mode=DELETE")
+        self.connection.executescript(self.SCHEMA)
+
+    def _transaction(self):
+        return _Immediate(self.connection)
+
+    def create_run(self, searches, run_id=storage.RUN_ID):
+        """Start a run with one search job per (site name, first page URL, page template)."""
+        with self._transaction():
+            self.connection.execute(
+                "INSERT OR REPLACE INTO runs VALUES (?, ?, NULL)",
+                (run_id, datetime.now().isoformat(timespec="seconds")),
+            )
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO jobs (run_id, kind, site, search, template, url, status) VALUES (?, 'search', ?, ?, ?, '', ?)",
+                [(run_id, site, search, template, QUEUED) for site, search, template in searches],
+            )
+        logger.info(f"Run {run_id}: {len(searches)} search jobs queued.")
+        return run_id
+
+    def current_run(self):
+        """The last run not reduced yet, or None."""
+        row = self.connection.execute(
+            "SELECT run_id FROM runs WHERE reduced_at IS NULL ORDER BY started_at DESC, run_id DESC LIMIT 1"
+        ).fetchone()
+        return row[0] if row else None
+
+    def claim(self, run_id, worker):
+        """Lease the next job of the run to `worker`: search jobs first, then pages. None when none is claimable."""
+        now = time.time()
+        with self._transaction():
+            row = self.connection.execute(
+                "SELECT job_id, run_id, kind, site, search, template, url, page, attempts FROM jobs "
+                "WHERE run_id = ? AND attempts < ? AND (status = ? OR (status = ? AND lease_expires < ?)) "
+                "ORDER BY kind = 'page', job_id LIMIT 1",
+                (run_id, self.max_attempts, QUEUED, LEASED, now),
+            ).fetchone()
+            if row is None:
+                return None
+            self.connection.execute(
+                "UPDATE jobs SET status = ?, worker = ?, lease_expires = ?, attempts = attempts + 1 WHERE job_id = ?",
+                (LEASED, worker, now + self.lease_seconds, row[0]),
+            )
+        job = Job(*row)
+        return job._replace(attempts=job.attempts + 1)
+
+    def add_pages(self, job, urls):
+        """Complete a search job, queueing one page job per result page in the same transaction."""
+        with self._transaction():
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO jobs (run_id, kind, site, search, url, page, status) VALUES (?, 'page', ?, ?, ?, ?, ?)",
+                [(job.run_id, job.site, job.search, url, page, QUEUED) for page, url in enumerate(urls)],
+            )
+            self.connection.execute("UPDATE jobs SET status = ? WHERE job_id = ?", (DONE, job.job_id))
+
+    def complete(self, jobs):
+        with self._transaction():
+            self.connection.executemany("UPDATE jobs SET status = ? WHERE job_id = ?", [(DONE, job.job_id) for job in jobs])
+
+    def fail(self, job):
+        """Release a job that failed: queued again, or failed for good after max_attempts claims."""
+        status = FAILED if job.attempts >= self.max_attempts else QUEUED
+        with self._transaction():
+            self.connection.execute("UPDATE jobs SET status = ?, lease_expires = NULL WHERE job_id = ?", (status, job.job_id))
+
+    def leased(self, run_id):
+        """Jobs of the run still leased by a worker (they may add page jobs, or come back when their lease expires)."""
+        return self.connection.execute(
+            "SELECT COUNT(*) FROM jobs WHERE run_id = ? AND status = ? AND (attempts < ? OR lease_expires >= ?)",
+            (run_id, LEASED, self.max_attempts, time.time()),
+        ).fetchone()[0]
+
+    def counts(self, run_id):
+        """{status: number of jobs} of a run."""
+        return dict(self.connection.execute(
+            "SELECT status, COUNT(*) FROM jobs WHERE run_id = ? GROUP BY status", (run_id,)
+        ).fetchall())
+
+    def mark_reduced(self, run_id):
+        with self._transaction():
+            self.connection.execute(
+                "UPDATE runs SET reduced_at = ? WHERE run_id = ?", (datetime.now().isoformat(timespec="seconds"), run_id)
+            )
+
+
+class _Immediate:
+    """BEGIN IMMEDIATE ... COMMIT (ROLLBACK on error): the write lock is taken before reading."""
+
+    def __init__(self, connection):
+        self.connection = connection
+
+    def __enter__(self):
+        self.connection.execute("BEGIN IMMEDIATE")
+        return self.connection
+
+    def __exit__(self, exc_type, exc, traceback):
+        self.connection.execute("ROLLBACK" if exc_type else "COMMIT")
+        return False
@@ -0,0 +1,223 @@
+"""Crawl journal: the frontier of a run, so an interrupted run can be resumed.
+
+A SQLite file (results/crawl_journal.sqlite) records every crawl, its
+searches (listed, or failed to list), the result pages listed for each
+search and the status of each page:
+pending, done (merged and saved in a session checkpoint), failed or skipped
+(left out by an early stop). The attempts made on a page are counted when it
+is fetched, so a page that keeps failing, or keeps crashing the run, is
+given up after JOURNAL_MAX_ATTEMPTS.
+
+A run that does not finish stays open. The next run, if it starts within
+JOURNAL_MAX_AGE, resumes it: searches already listed reuse their pages, done
+pages are skipped and only the missing or failed ones are fetched again.
+When a new crawl starts, the searches and pages of the closed ones are
+deleted, so the file (committed by the workflow) stays the size of one crawl.
+"""
+import os
+import sqlite3
+import threading
+from datetime import datetime, timedelta
+
+from ctools.clogger import logger
+from ctools import storage
+
+
+JOURNAL_PATH = 'results/crawl_journal.sqlite'
+# An open crawl older than this is not resumed. The workflow runs daily, so a
+# crashed run is resumed by the next scheduled one (done pages are already in the checkpoint)
+JOURNAL_MAX_AGE = timedelta(hours=36)
+# Attempts on a page (across resumed runs) before it is given up
+JOURNAL_MAX_ATTEMPTS = 3
+
+PENDING, DONE, FAILED, SKIPPED = "pending", "done", "failed", "skipped"
+
+
+class CrawlJournal:
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS crawls (
+        run_id TEXT PRIMARY KEY,
+        started_at TEXT NOT NULL,
+        full_sweep INTEGER NOT NULL,
+        finished_at TEXT
+    );
+    CREATE TABLE IF NOT EXISTS searches (
+        run_id TEXT NOT NULL,
+        site TEXT NOT NULL,
+        search TEXT NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        PRIMARY KEY (run_id, site, search)
+    );
+    CREATE TABLE IF NOT EXISTS pages (
+        run_id TEXT NOT NULL,
+        site TEXT NOT NULL,
+        search TEXT NOT NULL,
+        page INTEGER NOT NULL,
+        url TEXT NOT NULL,
+        status TEXT NOT NULL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        updated_at TEXT NOT NULL,
+        PRIMARY KEY (run_id, url)
+    );
+    CREATE INDEX IF NOT EXISTS pages_by_search ON pages (run_id, site, search, page);
+    """
+
+    def __init__(self, path=JOURNAL_PATH, max_age=JOURNAL_MAX_AGE, max_attempts=JOURNAL_MAX_ATTEMPTS):
+        self.path = path
+        self.max_age = max_age
+        self.max_attempts = max_attempts
+        self.run_id = None
+        self.full_sweep = None
+        self.resumed = False
+        # URLs merged into the session since its last checkpoint
+        self._processed = []
+        self._lock = threading.Lock()
+        if path != ":memory:" and os.path.dirname(path):
+            os.makedirs(os.path.dirname(path), exist_ok=True)
+        self.connection = sqlite3.connect(path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        with self.connection:
+            self.connection.executescript(self.SCHEMA)
+
+    def _now(self):
+        return datetime.now().isoformat(timespec="seconds")
+
+    def start(self, full_sweep, run_id=storage.RUN_ID):
+        """Resume the last open crawl if it is recent enough, or start a new one; True when resuming."""
+        with self._lock:
+            last = self.connection.execute(
+                "SELECT run_id, started_at, full_sweep FROM crawls WHERE finished_at IS NULL ORDER BY started_at DESC LIMIT 1"
+            ).fetchone()
+            if last is not None and datetime.now() - datetime.fromisoformat(last[1]) <= self.max_age:
+                self.run_id, self.full_sweep, self.resumed = last[0], bool(last[2]), True
+                left = self.connection.execute(
+                    "SELECT COUNT(*) FROM pages WHERE run_id = ? AND status != ?", (self.run_id, DONE)
+                ).fetchone()[0]
+                logger.info(f"Resuming crawl {self.run_id} (full sweep: {self.full_sweep}), {left} pages not done.")
+                return True
+
+            self.run_id, self.full_sweep, self.resumed = run_id, full_sweep, False
+            with self.connection:
+                # Older open crawls will never be resumed
+                self.connection.execute("UPDATE crawls SET finished_at = ? WHERE finished_at IS NULL", (self._now(),))
+                self.connection.execute(
+                    "INSERT OR REPLACE INTO crawls VALUES (?, ?, ?, NULL)", (run_id, self._now(), int(full_sweep))
+                )
+                # Closed crawls are never resumed: only their row in `crawls` is kept
+                for table in ("pages", "searches"):
+                    self.connection.execute(f"DELETE FROM {table} WHERE run_id != ?", (run_id,))
+            # Give the deleted pages back, so the file does not keep growing
+            self.connection.execute("VACUUM")
+            logger.info(f"Starting crawl {run_id} (full sweep: {full_sweep}).")
+            return False
+
+    def listed_pages(self, site, search):
+        """Page URLs of a search listed earlier in this crawl, in order; None when it was not listed."""
+        with self._lock:
+            rows = self.connection.execute(
+                "SELECT url FROM pages WHERE run_id = ? AND site = ? AND search = ? ORDER BY page",
+                (self.run_id, site, search),
+            ).fetchall()
+        return [url for url, in rows] if rows else None
+
+    def should_list(self, site, search):
+        """False for a search that failed to list its pages JOURNAL_MAX_ATTEMPTS times."""
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT attempts FROM searches WHERE run_id = ? AND site = ? AND search = ?", (self.run_id, site, search)
+            ).fetchone()
+        if row is not None and row[0] >= self.max_attempts:
+            logger.warning(f"Giving up on listing {search} after {row[0]} attempts.")
+            return False
+        return True
+
+    def search_failed(self, site, search):
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO searches VALUES (?, ?, ?, ?, 1) "
+                "ON CONFLICT (run_id, site, search) DO UPDATE SET status = excluded.status, attempts = attempts + 1",
+                (self.run_id, site, search, FAILED),
+            )
+
+    def list_pages(self, site, search, urls):
+        """Record the result pages of a search as pending."""
+        now = self._now()
+        with self._lock, self.connection:
+            self.connection.execute(
+                "INSERT INTO searches VALUES (?, ?, ?, ?, 0) "
+                "ON CONFLICT (run_id, site, search) DO UPDATE SET status = excluded.status",
+                (self.run_id, site, search, DONE),
+            )
+            self.connection.executemany(
+                "INSERT OR IGNORE INTO pages (run_id, site, search, page, url, status, updated_at) VALUES (?, ?, ?, ?, ?, ?, ?)",
+                [(self.run_id, site, search, page, url, PENDING, now) for page, url in enumerate(urls)],
+            )
+
+    def should_fetch(self, url):
+        """False for pages done in this crawl, skipped by an early stop, or out of attempts."""
+        with self._lock:
+            row = self.connection.execute(
+                "SELECT status, attempts FROM pages WHERE run_id = ? AND url = ?", (self.run_id, url)
+            ).fetchone()
+        if row is None:
+            return True
+        status, attempts = row
+        if status in (DONE, SKIPPED):
+            return False
+        if attempts >= self.max_attempts:
+            logger.warning(f"Giving up on {url} after {attempts} attempts.")
+            return False
+        return True
+
+    def _set(self, urls, status):
+        now = self._now()
+        with self._lock, self.connection:
+            self.connection.executemany(
+                "UPDATE pages SET status = ?, updated_at = ? WHERE run_id = ? AND url = ?",
+                [(status, now, self.run_id, url) for url in urls],
+            )
+
+    def page_started(self, url):
+        """Count an attempt on `url` before it is fetched, so a crash also counts."""
+        with self._lock, self.connection:
+            self.connection.execute(
+                "UPDATE pages SET attempts = attempts + 1, updated_at = ? WHERE run_id = ? AND url = ?",
+                (self._now(), self.run_id, url),
+            )
+
+    def page_failed(self, url):
+        self._set([url], FAILED)
+
+    def page_processed(self, url):
+        """`url` was merged into the session; it becomes done at the session's next checkpoint."""
+        self._processed.append(url)
+
+    def pages_skipped(self, urls):
+        """Pages left out by an early stop: nothing to resume."""
+        self._set(urls, SKIPPED)
+
+    def checkpoint(self):
+        """Mark done the pages merged since the last checkpoint (PropertySession calls it after each flush)."""
+        processed, self._processed = self._processed, []
+        if processed:
+            self._set(processed, DONE)
+
+    def finish(self):
+        """Close the crawl unless it has pages left to retry; True when it is finished."""
+        self.checkpoint()
+        with self._lock:
+            left = self.connection.execute(
+                "SELECT COUNT(*) FROM pages WHERE run_id = ? AND status IN (?, ?) AND attempts < ?",
+                (self.run_id, PENDING, FAILED, self.max_attempts),
+            ).fetchone()[0] + self.connection.execute(
+                "SELECT COUNT(*) FROM searches WHERE run_id = ? AND status = ? AND attempts < ?",
+                (self.run_id, FAILED, self.max_attempts),
+            ).fetchone()[0]
+            if left:
+                logger.warning(f"Crawl {self.run_id} left {left} pages to retry; the next run resumes it.")
+                return False
+            with self.connection:
+                self.connection.execute("UPDATE crawls SET finished_at = ? WHERE run_id = ?", (self._now(), self.run_id))
+        logger.info(f"Crawl {self.run_id} finished.")
+        return True
@@ -0,0 +1,219 @@
+"""Compact in-memory record of a listing, the core representation of cscrap.PropertyStore.
+
+A Listing uses __slots__ instead of a dict per row, keeps the agency and area
+names interned, price and size as integers (euros, m²), and no URL when the site's URL template
+rebuilds it from the ref (see URL_TEMPLATES, filled by sites.register).
+DataFrames are only built at the edges: extractor output, storage and email.
+
+Prices are normalized once, when a listing enters the store: parse_price for
+single records, parse_prices/normalize_prices for whole columns. Price texts
+with no amount ("Consultar") leave the price empty and are kept in the
+`price_text` column, which flags them.
+"""
+import numbers
+import re
+import sys
+
+import pandas as pd
+
+
+CORE_COLUMNS = ["ref", "price", "url", "inmobiliaria", "title", "area", "size", "first_seen", "last_seen"]
+# Extra columns filled from a listing's detail page (see ctools/details.py); result pages do not have them
+DETAIL_COLUMNS = ["rooms", "location", "photos"]
+
+# inmobiliaria -> template of the listing URL, formatted with `ref`
+URL_TEMPLATES = {}
+
+# First amount of a price text, '.' being the thousands separator: 45.000 €, 1.250.000, 45.000,50, 45000
+PRICE_PATTERN = r"(\d{1,3}(?:\.\d{3})+|\d+)(?:,\d+)?"
+PRICE_RE = re.compile(PRICE_PATTERN)
+# Built surface in a listing text: 85 m², 85 m2, 85,5 m2
+SIZE_RE = re.compile(r"(\d{1,3}(?:\.\d{3})*|\d+)(?:,\d+)?\s*m(?:²|2)", re.IGNORECASE)
+
+
+def parse_price(price):
+    """'45.000', '45.000 €', 45000 or 45000.0 -> 45000; None when there is no amount."""
+    if price is None or (not isinstance(price, str) and pd.isna(price)):
+        return None
+    if isinstance(price, numbers.Number):
+        return int(price)
+    match = PRICE_RE.search(price)
+    return int(match.group(1).replace(".", "")) if match else None
+
+
+def parse_size(size):
+    """'85 m²', 'Superficie: 85 m2' or 85 -> 85; None when there is no surface in m²."""
+    if size is None or (not isinstance(size, str) and pd.isna(size)):
+        return None
+    if isinstance(size, numbers.Number):
+        return int(size)
+    match = SIZE_RE.search(size)
+    return int(match.group(1).replace(".", "")) if match else None
+
+
+def parse_prices(prices):
+    """parse_price over a whole Series with string operations: (Int64 prices, unparseable mask).
+
+    Unparseable prices are texts with no amount, like "Consultar"; empty
+    values are just missing.
+    """
+    if pd.api.types.is_numeric_dtype(prices):
+        return prices.round().astype("Int64"), pd.Series(False, index=prices.index)
+    text = prices.astype("string").str.strip()
+    amounts = text.str.extract(PRICE_PATTERN, expand=False).str.replace(".", "", regex=False)
+    euros = pd.to_numeric(amounts, errors="coerce").astype("Int64")
+    unparseable = text.fillna("").ne("") & euros.isna()
+    return euros, unparseable.astype(bool)
+
+
+def normalize_prices(dataframe):
+    """`dataframe` with integer-euro prices; the texts that are not prices go to `price_text`."""
+    if dataframe is None or "price" not in dataframe:
+        return dataframe
+    euros, unparseable = parse_prices(dataframe["price"])
+    normalized = dataframe.assign(price=euros)
+    if unparseable.any():
+        previous = dataframe["price_text"] if "price_text" in dataframe else pd.Series(pd.NA, index=dataframe.index)
+        normalized["price_text"] = dataframe["price"].where(unparseable, previous).astype("string")
+    return normalized
+
+
+class Listing:
+    __slots__ = ("ref", "price", "inmobiliaria", "title", "area", "size", "first_seen", "last_seen", "_url", "extra")
+
+    def __init__(self, ref, price, inmobiliaria, url=None, first_seen=None, last_seen=None, extra=None,
+                 title=None, area=None, size=None):
+        self.ref = ref
+        self.price = parse_price(price)
+        self.title = title or None
+        self.area = sys.intern(area) if isinstance(area, str) and area else None
+        self.size = parse_size(size)
+        if self.price is None and isinstance(price, str) and price.strip():
+            # Flags the listing; the text is usually "Consultar" or similar
+            extra = dict(extra or {}, price_text=price.strip())
+        self.inmobiliaria = sys.intern(inmobiliaria) if isinstance(inmobiliaria, str) else inmobiliaria
+        self.first_seen = first_seen
+        self.last_seen = last_seen
+        # Extra columns some sites extract; None for the core ones
+        self.extra = extra or None
+        self._url = None if url == self.template_url() else url
+
+    @classmethod
+    def from_row(cls, row):
+        """Listing from a dict with the DataFrame columns (`ref`, `price`, `url`, `inmobiliaria`...)."""
+        # Missing extra values are left out: no dict for the rows that have none
+        extra = {
+            column: value for column, value in row.items()
+            if column not in CORE_COLUMNS and not _missing(value)
+        }
+        return cls(
+            row.get("ref"), row.get("price"), row.get("inmobiliaria"), row.get("url"),
+            _timestamp(row.get("first_seen")), _timestamp(row.get("last_seen")), extra,
+            _value(row.get("title")), _value(row.get("area")), _value(row.get("size")),
+        )
+
+    @property
+    def key(self):
+        return (self.inmobiliaria, self.ref)
+
+    def template_url(self):
+        template = URL_TEMPLATES.get(self.inmobiliaria)
+        return template.format(ref=self.ref) if template and self.ref is not None else None
+
+    @property
+    def url(self):
+        return self._url if self._url is not None else self.template_url()
+
+    def add_details(self, details):
+        """Fill size and DETAIL_COLUMNS from the values parsed from the detail page; missing ones are left as they are."""
+        size = parse_size(details.get("size"))
+        if size is not None:
+            self.size = size
+        found = {}
+        for column in DETAIL_COLUMNS:
+            value = details.get(column)
+            if isinstance(value, (list, tuple)):
+                # Photo URLs, space-separated like the other URL lists
+                value = " ".join(value)
+            if not _missing(value) and value != "":
+                found[column] = value
+        if found:
+            self.extra = dict(self.extra or {}, **found)
+
+    def keep_details(self, previous):
+        """Keep the detail-page values of `previous`, the record of the same listing this one replaces."""
+        kept = {
+            column: value for column, value in (previous.extra or {}).items()
+            if column in DETAIL_COLUMNS and column not in (self.extra or {})
+        }
+        if kept:
+            self.extra = dict(self.extra or {}, **kept)
+        if self.size is None:
+            self.size = previous.size
+
+    def same_values(self, other):
+        """True when `other` has the same price, URL, description and extra columns (the seen dates aside)."""
+        return (
+            self.price == other.price and self.url == other.url and self.extra == other.extra
+            and self.title == other.title and self.area == other.area and self.size == other.size
+        )
+
+    def __repr__(self):
+        return f"Listing({self.inmobiliaria!r}, {self.ref!r}, price={self.price!r})"
+
+
+def _missing(value):
+    return value is None or (pd.api.types.is_scalar(value) and pd.isna(value))
+
+
+def _value(value):
+    return None if _missing(value) else value
+
+
+def _timestamp(value):
+    if value is None or (not isinstance(value, str) and pd.isna(value)):
+        return None
+    return pd.Timestamp(value)
+
+
+def as_listing(item):
+    """Listing from a Listing or a row dict (as yielded by the site extractors)."""
+    return item if isinstance(item, Listing) else Listing.from_row(item)
+
+
+def from_frame(dataframe):
+    """Listings of the rows of a DataFrame, in order."""
+    if dataframe is None or dataframe.empty:
+        return []
+    return [Listing.from_row(row) for row in normalize_prices(dataframe).to_dict("records")]
+
+
+def prices_frame(listings):
+    """inmobiliaria, ref and price of each Listing: the baseline of price-change detection."""
+    return pd.DataFrame({
+        "inmobiliaria": [listing.inmobiliaria for listing in listings],
+        "ref": [listing.ref for listing in listings],
+        "price": pd.array([listing.price for listing in listings], dtype="Int64"),
+    })
+
+
+def to_frame(listings, columns):
+    """DataFrame with `columns` (plus any extra ones) for a list of Listings; prices as nullable integers."""
+    data = {
+        "ref": [listing.ref for listing in listings],
+        "price": pd.array([listing.price for listing in listings], dtype="Int64"),
+        "url": [listing.url for listing in listings],
+        "inmobiliaria": [listing.inmobiliaria for listing in listings],
+        "title": [listing.title for listing in listings],
+        "area": [listing.area for listing in listings],
+        "size": pd.array([listing.size for listing in listings], dtype="Int64"),
+        "first_seen": pd.to_datetime([listing.first_seen for listing in listings]),
+        "last_seen": pd.to_datetime([listing.last_seen for listing in listings]),
+    }
+    extra_columns = [column for listing in listings if listing.extra for column in listing.extra]
+    for column in dict.fromkeys(extra_columns):
+        data[column] = [(listing.extra or {}).get(column) for listing in listings]
+    if "rooms" in data:
+        data["rooms"] = pd.array(data["rooms"], dtype="Int64")
+    columns = list(dict.fromkeys(list(columns) + list(data)))
+    return pd.DataFrame(data, columns=columns)
@@ -0,0 +1,153 @@
+"""Run-level timers and counters, summarised per site in a JSON file at the end of a run.
+
+    with metrics.timer("fetch"):          # time a block
+        ...
+    @metrics.timed("parse")               # time every call of a function
+    metrics.count("cache_hit")            # bump a counter (or add bytes, retries...)
+
+Measurements are labelled with the site set by `metrics.site(name)` on the
+current thread (the engine sets it around each job), else with `default_site`.
+"""
+import inspect
+import json
+import os
+import threading
+import time
+from contextlib import contextmanager
+from datetime import datetime
+from functools import wraps
+
+from ctools.clogger import logger
+from ctools import storage
+
+
+METRICS_DIR = "results/metrics"
+PERCENTILES = (50, 95)
+# End marker of a timed generator
+_DONE = object()
+
+
+def percentile(values, q):
+    """Nearest-rank percentile of a non-empty list."""
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(q / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+class Metrics:
+    """Thread-safe store of timings (seconds) and counters, keyed by (site, name)."""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._local = threading.local()
+        self._timings = {}
+        self._counters = {}
+        self.started_at = datetime.now()
+        self._start = time.perf_counter()
+
+    @contextmanager
+    def site(self, name):
+        """Label the measurements taken by this thread inside the block with site `name`."""
+        previous = getattr(self._local, "site", None)
+        self._local.site = name
+        try:
+            yield
+        finally:
+            self._local.site = previous
+
+    def _site(self, default_site):
+        return getattr(self._local, "site", None) or default_site or "-"
+
+    def record(self, name, seconds, default_site=None):
+        with self._lock:
+            self._timings.setdefault((self._site(default_site), name), []).append(seconds)
+
+    def count(self, name, value=1, default_site=None):
+        with self._lock:
+            key = (self._site(default_site), name)
+            self._counters[key] = self._counters.get(key, 0) + value
+
+    @contextmanager
+    def timer(self, name, default_site=None):
+        start = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.record(name, time.perf_counter() - start, default_site)
+
+    def timed(self, name):
+        """Decorator version of timer(). For a generator function, times the work done while it is consumed."""
+        def decorator(function):
+            if inspect.isgeneratorfunction(function):
+                @wraps(function)
+                def generator_wrapper(*args, **kwargs):
+                    generator = function(*args, **kwargs)
+                    elapsed = 0.0
+                    try:
+                        while True:
+                            start = time.perf_counter()
+                            item = next(generator, _DONE)
+                            elapsed += time.perf_counter() - start
+                            if item is _DONE:
+                                return
+                            yield item
+                    finally:
+                        self.record(name, elapsed)
+                return generator_wrapper
+
+            @wraps(function)
+            def wrapper(*args, **kwargs):
+                with self.timer(name):
+                    return function(*args, **kwargs)
+            return wrapper
+        return decorator
+
+    def summary(self):
+        """Per-site timers (count, total, mean, p50, p95, max) and counters of the run so far."""
+        with self._lock:
+            timings = {key: list(values) for key, values in self._timings.items()}
+            counters = dict(self._counters)
+
+        sites = {}
+        for (site, name), values in sorted(timings.items()):
+            stats = {"count": len(values), "total": sum(values), "mean": sum(values) / len(values)}
+            for q in PERCENTILES:
+                stats[f"p{q}"] = percentile(values, q)
+            stats["max"] = max(values)
+            sites.setdefault(site, {"timers": {}, "counters": {}})["timers"][name] = {
+                key: round(value, 4) if isinstance(value, float) else value for key, value in stats.items()
+            }
+        for (site, name), value in sorted(counters.items()):
+            sites.setdefault(site, {"timers": {}, "counters": {}})["counters"][name] = value
+
+        return {
+            "run_id": storage.RUN_ID,
+            "started_at": self.started_at.isoformat(timespec="seconds"),
+            "duration": round(time.perf_counter() - self._start, 3),
+            "sites": sites,
+        }
+
+    def write_summary(self, directory=METRICS_DIR):
+        """Write the summary to `directory`/<run_id>.json and return its path."""
+        summary = self.summary()
+        os.makedirs(directory, exist_ok=True)
+        path = os.path.join(directory, f"{summary['run_id']}.json")
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(summary, file, indent=2)
+        logger.info(f"Run metrics saved to {path}.")
+        for site, values in summary["sites"].items():
+            timers = ", ".join(
+                f"{name} p50={stats['p50']:.3f}s p95={stats['p95']:.3f}s" for name, stats in values["timers"].items()
+            )
+            logger.info(f"{site}: {timers} | {values['counters']}")
+        return path
+
+
+METRICS = Metrics()
+
+site = METRICS.site
+record = METRICS.record
+count = METRICS.count
+timer = METRICS.timer
+timed = METRICS.timed
+write_summary = METRICS.write_summary
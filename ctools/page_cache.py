@@ -0,0 +1,145 @@
+"""Fetch cache for listing pages, keyed by a hash of the full URL.
+
+Every page is stored gzip-compressed next to a small JSON file with its URL,
+fetch time and HTTP validators (ETag / Last-Modified). Entries younger than the
+TTL are served as-is; older ones can be revalidated with a conditional request.
+The total size on disk is bounded by evicting the least recently used entries.
+"""
+import gzip
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import namedtuple
+from contextlib import contextmanager
+
+from ctools.clogger import logger
+
+
+CACHE_DIR = "cache"
+# Pages fetched less than this many seconds ago are reused without a request
+CACHE_TTL = 12 * 3600
+CACHE_MAX_BYTES = 200 * 1024 * 1024
+
+CacheEntry = namedtuple("CacheEntry", "url html fetched_at etag last_modified fresh")
+
+
+def url_key(url):
+    return hashlib.sha256(url.encode("utf-8")).hexdigest()
+
+
+@contextmanager
+def _replacing(path):
+    """Yield a temporary path to write, moved over `path` once complete: readers never see half a file."""
+    tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+    try:
+        yield tmp_path
+        os.replace(tmp_path, path)
+    finally:
+        if os.path.exists(tmp_path):
+            os.remove(tmp_path)
+
+
+class PageCache:
+    """Content-addressed, size-bounded LRU cache of page HTML."""
+
+    def __init__(self, directory=CACHE_DIR, ttl=CACHE_TTL, max_bytes=CACHE_MAX_BYTES):
+        self.directory = directory
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._sizes = None
+
+    def _paths(self, url):
+        key = url_key(url)
+        folder = os.path.join(self.directory, key[:2])
+        return os.path.join(folder, f"{key}.html.gz"), os.path.join(folder, f"{key}.json")
+
+    def get(self, url):
+        """Return the CacheEntry of `url` (fresh or stale), or None if it was never cached."""
+        html_path, meta_path = self._paths(url)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as file:
+                meta = json.load(file)
+            with gzip.open(html_path, "rt", encoding="utf-8") as file:
+                html = file.read()
+        except (OSError, ValueError, EOFError):
+            # Missing, or truncated by a run killed before put() was atomic: fetched again
+            return None
+
+        # The mtime of the page file records its last use, for LRU eviction
+        os.utime(html_path)
+        fresh = time.time() - meta["fetched_at"] < self.ttl
+        return CacheEntry(url, html, meta["fetched_at"], meta.get("etag"), meta.get("last_modified"), fresh)
+
+    def put(self, url, html, etag=None, last_modified=None):
+        html_path, meta_path = self._paths(url)
+        os.makedirs(os.path.dirname(html_path), exist_ok=True)
+        with _replacing(html_path) as tmp_path, gzip.open(tmp_path, "wt", encoding="utf-8") as file:
+            file.write(html)
+        self._write_meta(meta_path, url, etag, last_modified)
+
+        with self._lock:
+            sizes = self._scan()
+            sizes[html_path] = os.path.getsize(html_path)
+            if sum(sizes.values()) > self.max_bytes:
+                self._evict(sizes)
+
+    def touch(self, url, etag=None, last_modified=None):
+        """Mark a cached page as fetched now, after the server answered 304 Not Modified."""
+        _, meta_path = self._paths(url)
+        try:
+            with open(meta_path, "r", encoding="utf-8") as file:
+                meta = json.load(file)
+        except (OSError, ValueError):
+            return
+        self._write_meta(meta_path, url, etag or meta.get("etag"), last_modified or meta.get("last_modified"))
+
+    def entries(self):
+        """Yield (url, html) for every cached page."""
+        for entry in self.iter_entries():
+            yield entry.url, entry.html
+
+    def iter_entries(self):
+        """Yield the CacheEntry of every cached page."""
+        for folder, _, files in os.walk(self.directory):
+            for name in files:
+                if name.endswith(".json"):
+                    try:
+                        with open(os.path.join(folder, name), "r", encoding="utf-8") as file:
+                            url = json.load(file)["url"]
+                    except (OSError, ValueError, KeyError):
+                        logger.warning(f"Skipping the unreadable cache entry {name}.")
+                        continue
+                    entry = self.get(url)
+                    if entry is not None:
+                        yield entry
+
+    def _write_meta(self, meta_path, url, etag, last_modified):
+        meta = {"url": url, "fetched_at": time.time(), "etag": etag, "last_modified": last_modified}
+        with _replacing(meta_path) as tmp_path, open(tmp_path, "w", encoding="utf-8") as file:
+            json.dump(meta, file)
+
+    def _scan(self):
+        if self._sizes is None:
+            self._sizes = {}
+            for folder, _, files in os.walk(self.directory):
+                for name in files:
+                    if name.endswith(".html.gz"):
+                        path = os.path.join(folder, name)
+                        self._sizes[path] = os.path.getsize(path)
+        return self._sizes
+
+    def _evict(self, sizes):
+        total = sum(sizes.values())
+        for path in sorted(sizes, key=os.path.getmtime):
+            if total <= self.max_bytes:
+                break
+            total -= sizes.pop(path)
+            for stale in (path, path[: -len(".html.gz")] + ".json"):
+                try:
+                    os.remove(stale)
+                except OSError:
+                    pass
+            logger.info(f"Evicted {path} from the page cache.")
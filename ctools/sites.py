@@ -0,0 +1,76 @@
+"""Registry of the agencies scraped by ctools.engine.
+
+Each agency module declares one Site and registers it: how to build its search
+URLs, how to count the result pages of a search, what to wait for when a page
+is rendered, how to extract the listings and which fetch backend it needs.
+Adding an agency means writing those pieces and listing its module in
+SITE_MODULES; the crawl itself is shared.
+"""
+import importlib
+from collections import namedtuple
+from urllib.parse import urlparse
+
+from ctools import listing
+
+
+# Modules that register a Site when imported, in scraping order
+SITE_MODULES = ["axius", "inmocasal"]
+# Columns of the rows yielded by every Site.extract (title, area and size may be None)
+COLUMNS = ["ref", "price", "url", "inmobiliaria", "title", "area", "size"]
+
+# name: value of the 'inmobiliaria' column
+# searches(): (first_page_url, page_url_template) pairs scraped on every run
+# total_pages(fetcher, first_page_url): pagination strategy, number of result pages of a search
+# extract(page_source): generator of the listings of a result page, as row dicts with COLUMNS
+# wait_for: class the browser waits for before reading a result page
+# fetcher: 'http', 'selenium' or 'auto' (see cscrap.FETCHERS)
+# newest_first: results are sorted newest first, so a crawl may stop at known listings
+# url_template: listing URL formatted with `ref`, so records need not store it (see ctools.listing)
+# extract_details(page_source, url): dict with size, rooms, location and photos of a detail page (see ctools.details)
+# detail_wait_for: class the browser waits for before reading a detail page
+# first_page: number of the first result page in page_url_template (0, or 1 when the first URL is already page 1)
+Site = namedtuple(
+    "Site",
+    "name searches total_pages extract wait_for fetcher newest_first url_template extract_details detail_wait_for first_page",
+    defaults=("auto", False, None, None, None, 0),
+)
+
+SITES = {}
+
+
+def register(site):
+    SITES[site.name] = site
+    if site.url_template:
+        listing.URL_TEMPLATES[site.name] = site.url_template
+    return site
+
+
+def all_sites(names=None):
+    """Return the registered sites (all of them, or those in `names`), importing SITE_MODULES first."""
+    for module in SITE_MODULES:
+        importlib.import_module(module)
+    if names is None:
+        return list(SITES.values())
+    return [SITES[name] for name in names]
+
+
+def site_for_page(url, sites=None):
+    """The site of a result page URL (same host and path as one of its searches), or None."""
+    parsed = urlparse(url)
+    for site in all_sites() if sites is None else sites:
+        for first_page_url, _ in site.searches():
+            search = urlparse(first_page_url)
+            if (search.netloc, search.path) == (parsed.netloc, parsed.path):
+                return site
+    return None
+
+
+def page_urls(first_page_url, page_template, total_pages, first_page=0):
+    """URLs of the result pages of a search: the first page, then page_template numbered from first_page + 1."""
+    return [first_page_url] + [page_template.format(page=first_page + page) for page in range(1, total_pages)]
+
+
+def list_pages(site, fetcher, first_page_url, page_template):
+    """Return the URLs of every result page of a search of `site`."""
+    total_pages = site.total_pages(fetcher, first_page_url)
+    return page_urls(first_page_url, page_template, total_pages, site.first_page) if total_pages else []
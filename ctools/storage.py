@@ -0,0 +1,413 @@
+"""Storage backends behind cscrap.load_or_initialize_pickle / cscrap.save_to_pickle.
+
+"pickle" rewrites one DataFrame pickle on every save. "parquet" keeps the
+history as a directory of compressed Parquet files with typed columns (integer
+euros, categorical inmobiliaria, first/last seen timestamps). Every run writes
+its own partition and only appends the rows that changed, so files already
+committed are never rewritten. Listings seen again without changes only get
+their new last_seen, in a small per-run "seen" partition (key and last_seen)
+that loads fold back into the history. "sqlite" keeps a listing database with a
+price-history table, upserted page by page (see SqliteStore).
+
+Whatever the backend, price changes are appended to results/price_changes/,
+one Parquet partition per run holding only the listings whose price moved.
+"""
+import glob
+import os
+import shutil
+import sqlite3
+import threading
+from datetime import datetime
+
+import pandas as pd
+
+from ctools.clogger import logger
+from ctools import listing
+
+
+KEY = ["inmobiliaria", "ref"]
+SEEN_COLUMNS = ["first_seen", "last_seen"]
+RUN_ID = datetime.now().strftime("%Y%m%dT%H%M%S")
+# Run id given to rows copied from an old pickle, older than any real run
+MIGRATED_RUN_ID = "00000000T000000"
+COMPRESSION = "zstd"
+# Partitions (changes and seen) after which a load folds the history back into a single file
+COMPACT_AFTER = 60
+
+# Last state loaded or written per Parquet dataset, to append only the changes
+_persisted = {}
+
+
+def parse_price(prices):
+    """Convert prices like "45.000" or "45.000 €" to integer euros (nullable Int64)."""
+    return listing.parse_prices(prices)[0]
+
+
+def to_typed(dataframe, columns):
+    """Return `dataframe` with the typed columns of the Parquet store."""
+    typed = dataframe.reindex(columns=list(dict.fromkeys(list(columns) + SEEN_COLUMNS)))
+    typed["ref"] = typed["ref"].astype("string")
+    typed["inmobiliaria"] = typed["inmobiliaria"].astype("string").astype("category")
+    if "price" in typed:
+        typed["price"] = parse_price(typed["price"])
+    if "url" in typed:
+        typed["url"] = typed["url"].astype("string")
+    for column in SEEN_COLUMNS:
+        typed[column] = pd.to_datetime(typed[column])
+    return typed.reset_index(drop=True)
+
+
+def dataset_dir(file_path):
+    """'results/properties.pkl' -> 'results/properties'."""
+    return os.path.splitext(file_path)[0]
+
+
+def _partitions(directory, kind="run"):
+    return sorted(glob.glob(os.path.join(directory, f"{kind}=*", "*.parquet")))
+
+
+def _write_partition(dataframe, directory, run_id=RUN_ID, kind="run"):
+    run_dir = os.path.join(directory, f"{kind}={run_id}")
+    os.makedirs(run_dir, exist_ok=True)
+    part = len(glob.glob(os.path.join(run_dir, "*.parquet")))
+    path = os.path.join(run_dir, f"part-{part:04d}.parquet")
+    dataframe.to_parquet(path, compression=COMPRESSION, index=False)
+    return path
+
+
+def _collapse(dataframe):
+    """Keep the last observation of every key, with the earliest first_seen."""
+    dataframe = dataframe.assign(inmobiliaria=dataframe["inmobiliaria"].astype("string"))
+    first_seen = dataframe.groupby(KEY, dropna=False)["first_seen"].transform("min")
+    collapsed = dataframe.assign(first_seen=first_seen).drop_duplicates(subset=KEY, keep="last")
+    collapsed["inmobiliaria"] = collapsed["inmobiliaria"].astype("category")
+    return collapsed.reset_index(drop=True)
+
+
+def _apply_seen(dataframe, seen):
+    """Move the last_seen of `dataframe` forward to the latest one recorded in the `seen` partitions."""
+    if seen.empty:
+        return dataframe
+    seen = seen.assign(inmobiliaria=seen["inmobiliaria"].astype("string")).groupby(KEY)["last_seen"].max()
+    keys = pd.MultiIndex.from_arrays([dataframe["inmobiliaria"].astype("string"), dataframe["ref"]])
+    later = seen.reindex(keys).to_numpy()
+    last_seen = dataframe["last_seen"].to_numpy()
+    newer = pd.notna(later) & ~(later <= last_seen)
+    dataframe.loc[newer, "last_seen"] = later[newer]
+    return dataframe
+
+
+def _differs(previous, current, values):
+    """Mask of the rows of `current` that are new, or differ from `previous` in any of `values` (vectorized)."""
+    left = current[KEY + values].assign(inmobiliaria=current["inmobiliaria"].astype("string"))
+    # Columns new in this run (a new extra field) are missing from `previous`: rows with a value there changed
+    right = previous.reindex(columns=KEY + values).assign(inmobiliaria=previous["inmobiliaria"].astype("string"))
+    merged = left.merge(right, on=KEY, how="left", suffixes=("", "_prev"), indicator=True)
+
+    changed = (merged["_merge"] == "left_only").to_numpy()
+    for column in values:
+        a, b = merged[column], merged[f"{column}_prev"]
+        same = (a == b).fillna(False).astype(bool) | (a.isna() & b.isna())
+        changed |= ~same.to_numpy()
+    return changed
+
+
+def migrate_pickle(file_path, columns):
+    """One-shot copy of an existing pickle history into the Parquet dataset."""
+    dataframe = pd.read_pickle(file_path)
+    seen = pd.Timestamp(datetime.fromtimestamp(os.path.getmtime(file_path)))
+    for column in SEEN_COLUMNS:
+        if column not in dataframe:
+            dataframe[column] = seen
+    typed = to_typed(dataframe, columns)
+    path = _write_partition(typed, dataset_dir(file_path), run_id=seen.strftime("%Y%m%dT%H%M%S"))
+    logger.info(f"Migrated {len(typed)} rows from {file_path} to {path}.")
+
+
+def compact(directory, dataframe):
+    """Replace every partition of the dataset with a single one holding `dataframe`."""
+    staging = f"{directory}.compacting"
+    _write_partition(dataframe, staging)
+    shutil.rmtree(directory)
+    os.rename(staging, directory)
+    logger.info(f"Compacted {directory} into one partition of {len(dataframe)} rows.")
+
+
+def load_parquet(file_path, columns):
+    directory = dataset_dir(file_path)
+    if not os.path.isdir(directory) and os.path.exists(file_path):
+        migrate_pickle(file_path, columns)
+
+    parts = _partitions(directory)
+    seen_parts = _partitions(directory, kind="seen")
+    if not parts:
+        dataframe = to_typed(pd.DataFrame(columns=columns), columns)
+    else:
+        dataframe = _collapse(pd.concat([pd.read_parquet(part) for part in parts], ignore_index=True))
+        if seen_parts:
+            dataframe = _apply_seen(dataframe, pd.concat([pd.read_parquet(part) for part in seen_parts], ignore_index=True))
+    _persisted[directory] = dataframe
+
+    if len(parts) + len(seen_parts) > COMPACT_AFTER:
+        compact(directory, dataframe)
+    return dataframe
+
+
+def save_parquet(dataframe, file_path, columns):
+    directory = dataset_dir(file_path)
+    previous = _persisted.get(directory)
+    if previous is None:
+        previous = load_parquet(file_path, columns)
+
+    current = to_typed(dataframe, columns)
+    values = [column for column in current.columns if column not in KEY + SEEN_COLUMNS]
+    changed = _differs(previous, current, values)
+    if changed.any():
+        path = _write_partition(current[changed], directory)
+        logger.info(f"Appended {int(changed.sum())} changed rows to {path}.")
+    # Listings only seen again: their key and last_seen
+    seen = ~changed & _differs(previous, current, ["last_seen"])
+    if seen.any():
+        path = _write_partition(current.loc[seen, KEY + ["last_seen"]], directory, kind="seen")
+        logger.info(f"Recorded {int(seen.sum())} listings seen again in {path}.")
+    _persisted[directory] = current
+
+
+def price_changes(previous, current):
+    """Listings of `current` whose price differs from their price in `previous` (vectorized).
+
+    Both frames need KEY and "price". Listings missing from `previous`, or
+    without a price on either side, are not changes. Returns KEY, old_price,
+    price, change and seen_at (the listing's last_seen, when present).
+    """
+    columns = KEY + ["price"] + (["last_seen"] if "last_seen" in current else [])
+    left = current[columns].assign(inmobiliaria=current["inmobiliaria"].astype("string"), price=parse_price(current["price"]))
+    right = previous[KEY + ["price"]].assign(
+        inmobiliaria=previous["inmobiliaria"].astype("string"), price=parse_price(previous["price"])
+    )
+    merged = left.merge(right, on=KEY, how="inner", suffixes=("", "_old"))
+    changed = (merged["price"] != merged["price_old"]).fillna(False).astype(bool)
+    changes = merged[changed].rename(columns={"price_old": "old_price", "last_seen": "seen_at"})
+    changes = changes.assign(change=changes["price"] - changes["old_price"])
+    return changes.reindex(columns=KEY + ["old_price", "price", "change", "seen_at"]).reset_index(drop=True)
+
+
+def price_changes_dir(file_path):
+    """'results/properties.pkl' -> 'results/price_changes'."""
+    return os.path.join(os.path.dirname(file_path), "price_changes")
+
+
+def append_price_changes(changes, file_path, run_id=RUN_ID):
+    """Append this run's price changes to the change log (nothing is written when there are none)."""
+    if changes.empty:
+        return None
+    changes = changes.assign(run_id=run_id, seen_at=pd.to_datetime(changes["seen_at"]))
+    path = _write_partition(changes, price_changes_dir(file_path), run_id)
+    logger.info(f"Logged {len(changes)} price changes to {path}.")
+    return path
+
+
+def load_price_changes(file_path):
+    """Every logged price change, oldest run first."""
+    parts = _partitions(price_changes_dir(file_path))
+    if not parts:
+        return pd.DataFrame(columns=KEY + ["old_price", "price", "change", "seen_at", "run_id"])
+    return pd.concat([pd.read_parquet(part) for part in parts], ignore_index=True)
+
+
+class SqliteStore:
+    """SQLite listing database in WAL mode, so notebooks can read while a scrape writes.
+
+    `properties` holds one row per (inmobiliaria, ref), which is its primary key,
+    with the runs in which it was first and last seen. Triggers append to
+    `price_history` whenever a listing is inserted or its price changes.
+    Description and detail-page columns (DESCRIPTION_COLUMNS) are added to
+    databases created before them; a result card never erases the details.
+    """
+
+    # Columns of `properties` besides the key, price, URL and seen dates, with their SQLite types
+    DESCRIPTION_COLUMNS = {
+        "title": "TEXT", "area": "TEXT", "size": "INTEGER", "rooms": "INTEGER", "location": "TEXT", "photos": "TEXT",
+    }
+
+    SCHEMA = """
+    CREATE TABLE IF NOT EXISTS runs (
+        run_id TEXT PRIMARY KEY,
+        started_at TEXT NOT NULL
+    );
+    CREATE TABLE IF NOT EXISTS properties (
+        inmobiliaria TEXT NOT NULL,
+        ref TEXT NOT NULL,
+        price INTEGER,
+        url TEXT,
+        title TEXT,
+        area TEXT,
+        size INTEGER,
+        rooms INTEGER,
+        location TEXT,
+        photos TEXT,
+        first_seen TEXT,
+        last_seen TEXT,
+        first_run TEXT NOT NULL,
+        last_run TEXT NOT NULL,
+        PRIMARY KEY (inmobiliaria, ref)
+    );
+    CREATE INDEX IF NOT EXISTS properties_first_run ON properties (first_run);
+    CREATE TABLE IF NOT EXISTS price_history (
+        inmobiliaria TEXT NOT NULL,
+        ref TEXT NOT NULL,
+        price INTEGER,
+        run_id TEXT NOT NULL,
+        seen_at TEXT
+    );
+    CREATE INDEX IF NOT EXISTS price_history_key ON price_history (inmobiliaria, ref);
+    CREATE TRIGGER IF NOT EXISTS price_history_insert AFTER INSERT ON properties
+    BEGIN
+        INSERT INTO price_history VALUES (new.inmobiliaria, new.ref, new.price, new.last_run, new.last_seen);
+    END;
+    CREATE TRIGGER IF NOT EXISTS price_history_update AFTER UPDATE OF price ON properties
+    WHEN old.price IS NOT new.price
+    BEGIN
+        INSERT INTO price_history VALUES (new.inmobiliaria, new.ref, new.price, new.last_run, new.last_seen);
+    END;
+    """
+
+    UPSERT = """
+    INSERT INTO properties (
+        inmobiliaria, ref, price, url, title, area, size, rooms, location, photos, first_seen, last_seen, first_run, last_run
+    )
+    VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+    ON CONFLICT (inmobiliaria, ref) DO UPDATE SET
+        price = excluded.price,
+        url = excluded.url,
+        title = excluded.title,
+        area = excluded.area,
+        size = COALESCE(excluded.size, properties.size),
+        rooms = COALESCE(excluded.rooms, properties.rooms),
+        location = COALESCE(excluded.location, properties.location),
+        photos = COALESCE(excluded.photos, properties.photos),
+        last_seen = excluded.last_seen,
+        last_run = excluded.last_run
+    """
+    # Columns read back by load() and new_since()
+    SELECTED = "ref, price, url, inmobiliaria, title, area, size, rooms, location, photos, first_seen, last_seen"
+
+    def __init__(self, db_path, run_id=RUN_ID):
+        self.db_path = db_path
+        self.run_id = run_id
+        self._lock = threading.Lock()
+        self.connection = sqlite3.connect(db_path, check_same_thread=False)
+        self.connection.execute("PRAGMA journal_mode=WAL")
+        self.connection.execute("PRAGMA synchronous=NORMAL")
+        with self.connection:
+            self.connection.executescript(self.SCHEMA)
+            existing = {row[1] for row in self.connection.execute("PRAGMA table_info(properties)")}
+            for column, column_type in self.DESCRIPTION_COLUMNS.items():
+                if column not in existing:
+                    self.connection.execute(f"ALTER TABLE properties ADD COLUMN {column} {column_type}")
+            self.connection.execute(
+                "INSERT OR IGNORE INTO runs VALUES (?, ?)", (run_id, datetime.now().isoformat(timespec="seconds"))
+            )
+
+    def upsert(self, dataframe, run_id=None):
+        """Bulk upsert of a batch of listings, seen in `run_id` (this run by default), in one transaction."""
+        if dataframe is None or dataframe.empty:
+            return
+        run_id = run_id or self.run_id
+        typed = to_typed(dataframe, dataframe.columns)
+        now = datetime.now().isoformat(timespec="seconds")
+        description = typed.reindex(columns=list(self.DESCRIPTION_COLUMNS))
+        rows = [
+            (
+                inmobiliaria, ref,
+                None if pd.isna(price) else int(price),
+                None if pd.isna(url) else url,
+                *(_sql_value(value, self.DESCRIPTION_COLUMNS[column]) for column, value in zip(description.columns, values)),
+                now if pd.isna(first_seen) else first_seen.isoformat(timespec="seconds"),
+                now if pd.isna(last_seen) else last_seen.isoformat(timespec="seconds"),
+                run_id, run_id,
+            )
+            for inmobiliaria, ref, price, url, first_seen, last_seen, values in zip(
+                typed["inmobiliaria"], typed["ref"], typed["price"], typed["url"], typed["first_seen"], typed["last_seen"],
+                description.itertuples(index=False, name=None),
+            )
+        ]
+        with self._lock, self.connection:
+            self.connection.executemany(self.UPSERT, rows)
+
+    def upsert_listings(self, listings, run_id=None):
+        """Same as upsert() for ctools.listing.Listing records, without building a DataFrame."""
+        run_id = run_id or self.run_id
+        now = datetime.now().isoformat(timespec="seconds")
+        rows = [
+            (
+                str(item.inmobiliaria), str(item.ref), item.price, item.url, item.title, item.area, item.size,
+                *(_sql_value((item.extra or {}).get(column), self.DESCRIPTION_COLUMNS[column]) for column in listing.DETAIL_COLUMNS),
+                item.first_seen.isoformat(timespec="seconds") if item.first_seen is not None else now,
+                item.last_seen.isoformat(timespec="seconds") if item.last_seen is not None else now,
+                run_id, run_id,
+            )
+            for item in listings
+        ]
+        if rows:
+            with self._lock, self.connection:
+                self.connection.executemany(self.UPSERT, rows)
+
+    def load(self):
+        return pd.read_sql_query(f"SELECT {self.SELECTED} FROM properties", self.connection, parse_dates=SEEN_COLUMNS)
+
+    def new_since(self, run_id):
+        """Listings first seen in a run after `run_id` (uses the first_run index)."""
+        return pd.read_sql_query(
+            f"SELECT {self.SELECTED}, first_run FROM properties WHERE first_run > ?",
+            self.connection, params=(run_id,), parse_dates=SEEN_COLUMNS,
+        )
+
+    def price_history(self, inmobiliaria, ref):
+        return pd.read_sql_query(
+            "SELECT price, run_id, seen_at FROM price_history WHERE inmobiliaria = ? AND ref = ? ORDER BY rowid",
+            self.connection, params=(inmobiliaria, ref),
+        )
+
+    def close(self):
+        self.connection.close()
+
+
+def _sql_value(value, column_type):
+    """A DataFrame or Listing value as SQLite stores it: None when missing, INTEGER columns as int."""
+    if value is None or (pd.api.types.is_scalar(value) and pd.isna(value)):
+        return None
+    return int(value) if column_type == "INTEGER" else str(value)
+
+
+_databases = {}
+
+
+def database(file_path):
+    """Shared SqliteStore for 'results/properties.pkl' -> 'results/properties.db'."""
+    db_path = f"{os.path.splitext(file_path)[0]}.db"
+    if db_path not in _databases:
+        _databases[db_path] = SqliteStore(db_path)
+    return _databases[db_path]
+
+
+def load(file_path, columns, backend="pickle"):
+    if backend == "parquet":
+        return load_parquet(file_path, columns)
+    if backend == "sqlite":
+        db = database(file_path)
+        if os.path.exists(file_path) and db.connection.execute("SELECT COUNT(*) FROM properties").fetchone()[0] == 0:
+            db.upsert(pd.read_pickle(file_path), run_id=MIGRATED_RUN_ID)
+            logger.info(f"Migrated {file_path} to {db.db_path}.")
+        return db.load()
+    if os.path.exists(file_path):
+        return pd.read_pickle(file_path)
+    return pd.DataFrame(columns=columns)
+
+
+def save(dataframe, file_path, backend="pickle"):
+    if backend == "parquet":
+        return save_parquet(dataframe, file_path, dataframe.columns)
+    if backend == "sqlite":
+        return database(file_path).upsert(dataframe)
+    dataframe.to_pickle(file_path)
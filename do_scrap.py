@@ -1,51 +1,82 @@
-import os
-import pandas as pd
-
-from ctools.clogger import logger
-from ctools import cscrap
-from ctools import email_tools
-
-# # Load environment variables from .env file for local testing
-from dotenv import load_dotenv
-load_dotenv(override=True)
-
-# EMAIL Config
-sender_email = os.environ["EMAIL_USER"]
-receiver_email = os.environ["EMAIL_RECEIVER"]
-password = os.environ["EMAIL_PASS"]
-
-COLUMNS = ["ref", "price", "url", "inmobiliaria"]
-
-
-# Initialize the 'new_properties.pkl' as an empty DataFrame
-new_properties = 'results/new_properties.pkl'
-properties = 'results/properties.pkl'
-
-# --------------------------------- EJECUCIÓN PRINCIPAL
-empty_df = pd.DataFrame(columns=COLUMNS)
-cscrap.save_to_pickle(empty_df, new_properties)
-logger.info(f"Initialized a fresh new_properties file at {new_properties}.")
-
-
-# AXIUS
-import axius
-folder_name = 'axius'
-axius.scrap(folder_name)
-
-axius_df = pd.read_pickle(properties)
-logger.info(axius_df)
-
-# INMOCASAL
-import inmocasal
-folder_name = 'inmocasal'
-inmocasal.scrap(folder_name)
-
-inmocasal_df = pd.read_pickle(properties)
-logger.info(inmocasal_df)
-
-
-# ------------- EMAILING
-logger.info('-'*100)
-new_properties_df = pd.read_pickle(new_properties)
-logger.info(new_properties_df)
-email_tools.emailing(new_properties_df, new_properties, sender_email, receiver_email, password)
\ No newline at end of file
+import os
+import pandas as pd
+
+from ctools.clogger import logger, frame_summary
+from ctools import cscrap
+from ctools import dedup
+from ctools import details
+from ctools import email_tools
+from ctools import metrics
+from ctools import time_lapse
+from ctools import engine
+from ctools import journal as crawl_journal
+from ctools import sites
+
+# # Load environment variables from .env file for local testing
+from dotenv import load_dotenv
+load_dotenv(override=True)
+
+# EMAIL Config
+sender_email = os.environ["EMAIL_USER"]
+receiver_email = os.environ["EMAIL_RECEIVER"]
+password = os.environ["EMAIL_PASS"]
+
+COLUMNS = sites.COLUMNS
+
+
+# Initialize the 'new_properties.pkl' as an empty DataFrame
+new_properties = 'results/new_properties.pkl'
+properties = 'results/properties.pkl'
+
+def reset_new_properties():
+    empty_df = pd.DataFrame(columns=COLUMNS)
+    cscrap.save_to_pickle(empty_df, new_properties)
+    logger.info(f"Initialized a fresh new_properties file at {new_properties}.")
+
+
+# --------------------------------- EJECUCIÓN PRINCIPAL
+# Resume the last crawl if it was interrupted recently; otherwise start a new one.
+# Full sweep of every page once a week; otherwise stop at the already known listings
+journal = crawl_journal.CrawlJournal()
+journal.start(cscrap.full_sweep_due())
+full_sweep = journal.full_sweep
+logger.info(f"Full sweep: {full_sweep}")
+
+# A resumed crawl keeps the new properties its interrupted run did not email
+if not journal.resumed:
+    reset_new_properties()
+
+# Every registered site (AXIUS, INMOCASAL), imported before the history is loaded
+site_list = sites.all_sites()
+
+with cscrap.PropertySession(properties, new_properties, COLUMNS) as session:
+    known = len(session.store)
+    # Detail pages of the new and repriced listings only, fetched as the crawl finds them
+    enricher = details.DetailEnricher(session, site_list)
+    # All sites through one shared work queue
+    engine.run(session, site_list, full_sweep, journal=journal, enricher=enricher)
+    enricher.finish()
+    logger.info(frame_summary(session.data, known, "properties"))
+price_drops = session.price_drops()
+finished = journal.finish()
+
+if full_sweep and finished:
+    time_lapse.update_last_full_sweep_date()
+
+# Timings and counters of the run, per site, in results/metrics/<run_id>.json
+metrics.write_summary()
+
+
+# ------------- EMAILING
+logger.info('-'*100)
+new_properties_df = pd.read_pickle(new_properties)
+# One row per flat: the same flat at both agencies, or listed again, is emailed once
+new_properties_df = dedup.collapse_new(new_properties_df, session.data)
+cscrap.save_to_pickle(new_properties_df, new_properties)
+logger.info(frame_summary(new_properties_df, name="new_properties"))
+logger.info(f"{len(price_drops)} price drops in this run.")
+email_tools.emailing(new_properties_df, new_properties, sender_email, receiver_email, password, price_drops)
+
+if not finished:
+    # Already emailed: the run that resumes this crawl only sends what it finds
+    reset_new_properties()
\ No newline at end of file
@@ -0,0 +1,114 @@
+"""Asyncio version of do_scrap.py that overlaps fetching, parsing and persistence.
+
+The three stages are linked by bounded queues: page N+1 downloads while page N
+is parsed in an executor and page N-1 is merged into the run's property session
+by the single persistence stage. Each site keeps one fetcher, so no browser
+instances are added compared to the sequential run.
+"""
+import asyncio
+import os
+import pandas as pd
+
+from ctools.clogger import logger, frame_summary
+from ctools import cscrap
+from ctools import dedup
+from ctools import email_tools
+from ctools import metrics
+from ctools import sites
+
+# # Load environment variables from .env file for local testing
+from dotenv import load_dotenv
+load_dotenv(override=True)
+
+
+COLUMNS = sites.COLUMNS
+# Pages allowed to wait between two stages
+QUEUE_SIZE = 2
+
+new_properties = 'results/new_properties.pkl'
+properties = 'results/properties.pkl'
+
+
+async def fetch_stage(site, parse_queue):
+    """Download the pages of every search of `site`, one at a time, and hand them to the parse stage."""
+    with cscrap.get_fetcher(site.fetcher, pool_size=1) as fetcher:
+        for base_url, page_template in site.searches():
+            try:
+                pages = await asyncio.to_thread(sites.list_pages, site, fetcher, base_url, page_template)
+                for url in pages:
+                    page_source = await asyncio.to_thread(cscrap.save_html, fetcher, url, wait_for=site.wait_for)
+                    await parse_queue.put((site, url, page_source))
+            except Exception as e:
+                logger.error(f'Excepcion fetching {base_url}: {e}')
+
+
+def extract(site, page_source):
+    with metrics.site(site.name):
+        # Consume the extractor here, so parsing stays in the executor
+        return list(site.extract(page_source))
+
+
+async def parse_stage(parse_queue, persist_queue):
+    """Extract the listings of each downloaded page in the default executor."""
+    loop = asyncio.get_running_loop()
+    while (item := await parse_queue.get()) is not None:
+        site, url, page_source = item
+        extracted_data = await loop.run_in_executor(None, extract, site, page_source)
+        await persist_queue.put((site, url, extracted_data))
+    await persist_queue.put(None)
+
+
+async def persist_stage(persist_queue, session):
+    """Single writer: merge each parsed page into the property session."""
+    while (item := await persist_queue.get()) is not None:
+        site, url, extracted_data = item
+        logger.info(f"Storing {url}...")
+        try:
+            with metrics.site(site.name):
+                session.add(extracted_data)
+        except Exception as e:
+            logger.error(f'Excepcion storing {url}: {e}')
+
+
+async def run_pipeline(session, site_list=None):
+    site_list = sites.all_sites() if site_list is None else site_list
+    parse_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+    persist_queue = asyncio.Queue(maxsize=QUEUE_SIZE)
+
+    parser = asyncio.create_task(parse_stage(parse_queue, persist_queue))
+    persister = asyncio.create_task(persist_stage(persist_queue, session))
+
+    await asyncio.gather(*(fetch_stage(site, parse_queue) for site in site_list))
+    await parse_queue.put(None)
+    await asyncio.gather(parser, persister)
+
+
+def main():
+    # EMAIL Config
+    sender_email = os.environ["EMAIL_USER"]
+    receiver_email = os.environ["EMAIL_RECEIVER"]
+    password = os.environ["EMAIL_PASS"]
+
+    # Initialize the 'new_properties.pkl' as an empty DataFrame
+    empty_df = pd.DataFrame(columns=COLUMNS)
+    cscrap.save_to_pickle(empty_df, new_properties)
+    logger.info(f"Initialized a fresh new_properties file at {new_properties}.")
+
+    site_list = sites.all_sites()
+    with cscrap.PropertySession(properties, new_properties, COLUMNS) as session:
+        asyncio.run(run_pipeline(session, site_list))
+    price_drops = session.price_drops()
+    metrics.write_summary()
+
+    # ------------- EMAILING
+    logger.info('-'*100)
+    new_properties_df = pd.read_pickle(new_properties)
+    # One row per flat: the same flat at both agencies, or listed again, is emailed once
+    new_properties_df = dedup.collapse_new(new_properties_df, session.data)
+    cscrap.save_to_pickle(new_properties_df, new_properties)
+    logger.info(frame_summary(new_properties_df, name="new_properties"))
+    email_tools.emailing(new_properties_df, new_properties, sender_email, receiver_email, password, price_drops)
+
+
+if __name__ == "__main__":
+    main()
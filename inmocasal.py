@@ -1,181 +1,174 @@
-import os
-import math
-import pandas as pd
-from bs4 import BeautifulSoup
-from selenium.webdriver.common.by import By
-from selenium.webdriver.support import expected_conditions as EC
-
-from ctools.clogger import logger
-from ctools import cscrap
-
-
-COLUMNS = ["ref", "price", "url", "inmobiliaria"]
-FOLDER_NAME = 'inmocasal'
-
-
-def extract_data_from_html(html_file):
-    """Extract relevant data from the HTML file using BeautifulSoup."""
-    try:
-        with open(html_file, "r", encoding="utf-8") as file:
-            soup = BeautifulSoup(file.read(), "html.parser")
-
-        # Step 1: Extract DIVs
-        div_elements = soup.select("div.zt-prop-blog-minis-item")
-        div_data = []
-
-        for div in div_elements:
-            try:
-                # Extract Ref and Price tags from the div
-                ref_tag = div.find("strong", string=lambda s: s and "Ref. " in s)
-                price_tag = div.find("b")
-                
-                ref = ref_tag.string.replace("Ref. ", "").strip() if ref_tag else None
-                price = price_tag.string.replace("€", "").strip() if price_tag else None
-                url = f"https://www.inmocasal.es/propiedad/?referencia={ref}"
-
-                # Store the extracted data
-                if ref or price:
-                    div_data.append({"ref": ref, "price": price, "url": url, "inmobiliaria": FOLDER_NAME})
-                else:
-                    logger.info(f"Skipping div with no data: {div}")
-
-            except Exception as e:
-                logger.error(f"Error processing div {div}: {e}")
-
-        # Return the DataFrame after processing all divs
-        return pd.DataFrame(div_data)
-        
-    except Exception as e:
-        logger.error(f"Error extract_data_from_html(): {e}")
-
-
-
-
-
-
-
-def process_page(driver, url, html_file, pickle_file, new_pickle_file):
-    """Process a single page and update the main and new properties pickle files."""
-    condition = EC.presence_of_element_located((By.CLASS_NAME, "zt-prop-blog-minis-item"))
-    cscrap.save_html(driver, url, html_file, wait_until=condition)
-    extracted_data = extract_data_from_html(html_file)
-
-    # Load existing data
-    existing_data = cscrap.load_or_initialize_pickle(pickle_file, COLUMNS)
-
-    # Identify new properties
-    temp_existing_data = existing_data[existing_data['inmobiliaria'] == FOLDER_NAME]
-    new_properties = extracted_data[
-        (~extracted_data["ref"].isin(temp_existing_data["ref"])) &
-        (extracted_data["inmobiliaria"] == FOLDER_NAME)
-    ]
-    
-    # Update the main dataset
-    updated_data = cscrap.merge_dataframes(existing_data, extracted_data)
-    cscrap.save_to_pickle(updated_data, pickle_file)
-
-    # Save new properties to separate pickle
-    if not new_properties.empty:
-        existing_new_properties = cscrap.load_or_initialize_pickle(new_pickle_file, COLUMNS)
-        combined_new_properties = cscrap.merge_dataframes(existing_new_properties, new_properties)
-        cscrap.save_to_pickle(combined_new_properties, new_pickle_file)
-
-    logger.info(f"Number of items: {len(updated_data)}")
-
-def get_total_pages(driver, url, output_dir):
-    html_file = os.path.join(output_dir, f"page_1.html")
-    condition = EC.presence_of_element_located((By.CLASS_NAME, "zt-paginacion"))
-    cscrap.save_html(driver, url, html_file, wait_until=condition)
-
-    try:
-        with open(html_file, "r", encoding="utf-8") as file:
-            soup = BeautifulSoup(file.read(), "html.parser")
-
-        # Select the div with the class "zt-paginacion"
-        div_elements = soup.select("div.zt-paginacion")
-        
-        # Iterate over div_elements to find the correct span
-        for div in div_elements:
-            span = div.find("span", string=lambda s: s and "Página 1 de " in s)
-            if span:
-                total_pages = int(span.string.strip().replace("Página 1 de ", ""))
-                logger.info(f'Número de páginas: {total_pages}')
-                return total_pages
-
-        # If no span is found, return 0
-        logger.info("No matching span found for total pages.")
-        return 0
-
-    except Exception as e:
-        logger.info(f"Error get_total_pages(). Exception: {e}")
-        return 0
-
-
-
-
-def scrape_all_pages(base_url, page_template, output_dir, main_pickle_file, new_pickle_file):
-    """Scrape multiple pages and consolidate the data, starting with a new 'new_properties.pkl'."""
-    os.makedirs(output_dir, exist_ok=True)
-
-    driver = cscrap.initialize_driver()
-    try:
-        total_items = get_total_pages(driver, base_url, output_dir)
-        logger.info(f'Total Properties: {total_items}')
-        total_pages = total_items
-        for page in range(total_pages):
-            url = base_url if page == 0 else page_template.format(page=page)
-            html_file = os.path.join(output_dir, f"page_{page + 1}.html")
-            logger.info('-'*100)
-            logger.info(f"Scraping page {page + 1}/{total_pages}...")
-            process_page(driver, url, html_file, main_pickle_file, new_pickle_file)
-    except Exception as e:
-        logger.error(f'Excepcion: {e}')
-    finally:
-        driver.quit()
-
-
-
-def scrap(folder_name):
-    properties_path = 'results/properties.pkl'
-    new_properties_path = 'results/new_properties.pkl'
-    
-    # Define the areas and propiedades to iterate over
-    areas = [3, 4, 5]
-    propiedades = [2, 6]
-
-    # Loop through all combinations of areas and propiedades
-    for area in areas:
-        for propiedad in propiedades:
-            first_page_url = f"https://www.inmocasal.es/busqueda-avanzada/?gestion=comprar&propiedad={propiedad}&area={area}&precioMin=0&precioMax=75000&ordenar=1&pagina=1"
-            page_url_template = f"https://www.inmocasal.es/busqueda-avanzada/?gestion=comprar&propiedad={propiedad}&area={area}&precioMin=0&precioMax=75000&ordenar=1&pagina={{page}}"
-
-            # Call the scraping function for each combination
-            scrape_all_pages(
-                base_url=first_page_url,
-                page_template=page_url_template,
-                output_dir=folder_name,
-                main_pickle_file=properties_path,
-                new_pickle_file=new_properties_path,
-            )
-
-
-# def scrap(folder_name):
-#     properties_path = 'results/properties.pkl'
-#     new_properties_path = 'results/new_properties.pkl'
-#     # ----------------------- SCRAPPING ------------------------------------ 
-
-#     # ------------- PROPIEDAD 6 (PISOS) AREA 5 (Área de La Felguera, Sama y Laviana) -------------
-#     propiedad = 6
-#     area = 5
-#     first_page_url = f"https://www.inmocasal.es/busqueda-avanzada/?gestion=comprar&propiedad={propiedad}&area={area}&precioMax=75000&ordenar=1&pagina=1"
-#     page_url_template = f"https://www.inmocasal.es/busqueda-avanzada/?gestion=comprar&propiedad={propiedad}&area={area}&precioMax=75000&ordenar=1&pagina="
-#     page_url_template += "{page}"
-
-#     scrape_all_pages(
-#         base_url=first_page_url,
-#         page_template=page_url_template,
-#         output_dir=folder_name,
-#         main_pickle_file=properties_path,
-#         new_pickle_file=new_properties_path,
-#     )
+import pandas as pd
+import lxml.html
+
+from ctools.clogger import logger
+from ctools import cscrap
+from ctools import details
+from ctools import sites
+from ctools import engine
+from ctools import listing
+from ctools import metrics
+
+
+FOLDER_NAME = 'inmocasal'
+# Listings are in the static HTML; the browser is only a fallback
+FETCHER = 'auto'
+# Searches are sorted newest first (ordenar=1), so a crawl can stop at known listings
+NEWEST_FIRST = True
+# Listing URL, rebuilt from the ref instead of being stored
+URL_TEMPLATE = "https://www.inmocasal.es/propiedad/?referencia={ref}"
+PAGE_WAIT_FOR = "zt-prop-blog-minis-item"
+# `pagina` counts from 1 and the first URL of a search is already pagina=1
+FIRST_PAGE = 1
+# Detail pages (propiedad/?referencia=) are in the static HTML
+DETAIL_WAIT_FOR = None
+# Price cap of the searches, in euros; per-user budgets are applied afterwards (see ctools/filters.py)
+MAX_PRICE = 75000
+# Search matrix: every area with every property type (2: casas, 6: pisos).
+# Area 5 is La Felguera, Sama y Laviana. Each pair is a search (a job in shard.py).
+AREAS = [3, 4, 5]
+PROPIEDADES = [2, 6]
+
+REF_STRONG = cscrap.xpath(".//strong[contains(text(), 'Ref. ')]")
+TITLE_TAG = cscrap.xpath(".//h2 | .//h3 | .//h4")
+LOCATION_TAG = cscrap.xpath(".//*[contains(@class, 'location') or contains(@class, 'address') or contains(@class, 'zona')]")
+PAGES_SPAN = cscrap.xpath(".//span[contains(text(), 'Página 1 de ')]")
+# Detail page: features list (surface, rooms...), location and photo gallery
+DETAIL_FEATURES = cscrap.xpath("//*[contains(@class, 'caracteristicas') or contains(@class, 'features')]")
+DETAIL_LOCATION = cscrap.xpath("//*[contains(@class, 'location') or contains(@class, 'zona') or contains(@class, 'address')]")
+DETAIL_GALLERY = cscrap.xpath("//*[contains(@class, 'galeria') or contains(@class, 'gallery') or contains(@class, 'slider')]")
+
+
+@metrics.timed("parse")
+def iter_listings(page_source):
+    """Yield the listings of a result page, as dicts, while it is parsed in memory with lxml."""
+    try:
+        div_elements = cscrap.parse_html(page_source, containers="div.zt-prop-blog-minis-item")
+    except Exception as e:
+        logger.error(f"Error iter_listings(): {e}")
+        return
+
+    for div in div_elements:
+        try:
+            # Extract Ref and Price tags from the div
+            ref_tag = next(iter(REF_STRONG(div)), None)
+            price_tag = next(iter(cscrap.select(div, "b")), None)
+
+            title_tag = next(iter(TITLE_TAG(div)), None)
+            location_tag = next(iter(LOCATION_TAG(div)), None)
+
+            ref = ref_tag.text_content().replace("Ref. ", "").strip() if ref_tag is not None else None
+            price = price_tag.text_content().replace("€", "").strip() if price_tag is not None else None
+            url = URL_TEMPLATE.format(ref=ref)
+            title = " ".join(title_tag.text_content().split()) if title_tag is not None else None
+            area = " ".join(location_tag.text_content().split()) if location_tag is not None else None
+            # Surface in m², wherever the card shows it
+            size = listing.parse_size(div.text_content())
+
+            if ref or price:
+                yield {
+                    "ref": ref, "price": price, "url": url, "inmobiliaria": FOLDER_NAME,
+                    "title": title, "area": area, "size": size,
+                }
+            else:
+                logger.info(f"Skipping div with no data: {lxml.html.tostring(div, encoding='unicode')}")
+
+        except Exception as e:
+            logger.error(f"Error processing div {div}: {e}")
+
+
+def extract_details(page_source, url):
+    """Size, rooms, location and photos of a propiedad page (see ctools.details)."""
+    root = cscrap.parse_html(page_source)
+    features = " ".join(element.text_content() for element in DETAIL_FEATURES(root)) or root.text_content()
+    location_tag = next(iter(DETAIL_LOCATION(root)), None)
+    return {
+        "size": listing.parse_size(features),
+        "rooms": details.parse_rooms(features),
+        "location": " ".join(location_tag.text_content().split()) if location_tag is not None else None,
+        "photos": details.photo_urls(DETAIL_GALLERY(root), url),
+    }
+
+
+def extract_data_from_html(page_source):
+    """DataFrame of the listings of a result page (for notebooks and benchmarks; the engine streams iter_listings)."""
+    return pd.DataFrame(list(iter_listings(page_source)))
+
+
+def get_total_pages(fetcher, url):
+    page_source = cscrap.save_html(fetcher, url, wait_for="zt-paginacion")
+
+    try:
+        # Select the div with the class "zt-paginacion"
+        div_elements = cscrap.parse_html(page_source, containers="div.zt-paginacion")
+        
+        # Iterate over div_elements to find the correct span
+        for div in div_elements:
+            span = next(iter(PAGES_SPAN(div)), None)
+            if span is not None:
+                total_pages = int(span.text_content().strip().replace("Página 1 de ", ""))
+                logger.info(f'Número de páginas: {total_pages}')
+                return total_pages
+
+        # If no span is found, return 0
+        logger.info("No matching span found for total pages.")
+        return 0
+
+    except Exception as e:
+        logger.info(f"Error get_total_pages(). Exception: {e}")
+        return 0
+
+
+
+
+def get_searches():
+    """Return the (first_page_url, page_url_template) pairs scraped on every run."""
+    # Loop through all combinations of areas and propiedades
+    searches = []
+    for area in AREAS:
+        for propiedad in PROPIEDADES:
+            first_page_url = f"https://www.inmocasal.es/busqueda-avanzada/?gestion=comprar&propiedad={propiedad}&area={area}&precioMin=0&precioMax={MAX_PRICE}&ordenar=1&pagina=1"
+            page_url_template = f"https://www.inmocasal.es/busqueda-avanzada/?gestion=comprar&propiedad={propiedad}&area={area}&precioMin=0&precioMax={MAX_PRICE}&ordenar=1&pagina={{page}}"
+            searches.append((first_page_url, page_url_template))
+    return searches
+
+
+SITE = sites.register(sites.Site(
+    name=FOLDER_NAME,
+    searches=get_searches,
+    total_pages=get_total_pages,
+    extract=iter_listings,
+    wait_for=PAGE_WAIT_FOR,
+    fetcher=FETCHER,
+    newest_first=NEWEST_FIRST,
+    url_template=URL_TEMPLATE,
+    extract_details=extract_details,
+    detail_wait_for=DETAIL_WAIT_FOR,
+    first_page=FIRST_PAGE,
+))
+
+
+def scrap(session=None, full_sweep=None):
+    engine.scrap([SITE], session, full_sweep)
+
+
+# def scrap(folder_name):
+#     properties_path = 'results/properties.pkl'
+#     new_properties_path = 'results/new_properties.pkl'
+#     # ----------------------- SCRAPPING ------------------------------------ 
+
+#     # ------------- PROPIEDAD 6 (PISOS) AREA 5 (Área de La Felguera, Sama y Laviana) -------------
+#     propiedad = 6
+#     area = 5
+#     first_page_url = f"https://www.inmocasal.es/busqueda-avanzada/?gestion=comprar&propiedad={propiedad}&area={area}&precioMax=75000&ordenar=1&pagina=1"
+#     page_url_template = f"https://www.inmocasal.es/busqueda-avanzada/?gestion=comprar&propiedad={propiedad}&area={area}&precioMax=75000&ordenar=1&pagina="
+#     page_url_template += "{page}"
+
+#     scrape_all_pages(
+#         base_url=first_page_url,
+#         page_template=page_url_template,
+#         output_dir=folder_name,
+#         main_pickle_file=properties_path,
+#         new_pickle_file=new_properties_path,
+#     )
     
\ No newline at end of file
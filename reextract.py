@@ -0,0 +1,85 @@
+"""Re-extract every listing page of the page cache into the properties store.
+
+Run it after changing a site's selectors or adding a field. Cached result
+pages are parsed in a ProcessPoolExecutor (one process per core), then all
+their listings are merged into the store in one bulk upsert. Each page counts
+as seen when it was fetched, so first_seen/last_seen stay those of the crawl.
+new_properties.pkl is not touched: a backfill sends no email.
+
+    python reextract.py [--workers 8] [--dry-run]
+"""
+import argparse
+import os
+from concurrent.futures import ProcessPoolExecutor
+
+import pandas as pd
+
+from ctools.clogger import logger
+from ctools import cscrap
+from ctools import storage
+from ctools import sites
+
+
+properties = 'results/properties.pkl'
+# Pages sent to a worker process at a time
+CHUNK_SIZE = 16
+
+
+def extract_page(site_name, page_source, fetched_at):
+    """Worker: the listings of one cached page, as row dicts stamped with the page's fetch time."""
+    site = sites.all_sites([site_name])[0]
+    seen = pd.Timestamp.fromtimestamp(fetched_at)
+    return [dict(row, first_seen=seen, last_seen=seen) for row in site.extract(page_source)]
+
+
+def cached_pages(cache=cscrap.PAGE_CACHE):
+    """(site name, html, fetched_at) of every cached result page of a registered site, oldest first."""
+    site_list = sites.all_sites()
+    pages = []
+    for entry in cache.iter_entries():
+        site = sites.site_for_page(entry.url, site_list)
+        if site is not None:
+            pages.append((site.name, entry.html, entry.fetched_at))
+    return sorted(pages, key=lambda page: page[2])
+
+
+def reextract(workers=None, dry_run=False, file_path=properties):
+    pages = cached_pages()
+    logger.info(f"Re-extracting {len(pages)} cached pages with {workers or os.cpu_count()} processes...")
+    if not pages:
+        return []
+
+    names, page_sources, fetched_at = zip(*pages)
+    with ProcessPoolExecutor(max_workers=workers, initializer=sites.all_sites) as executor:
+        extracted = executor.map(extract_page, names, page_sources, fetched_at, chunksize=CHUNK_SIZE)
+        # Oldest pages first, so the latest observation of a listing wins
+        rows = [row for page in extracted for row in page]
+    logger.info(f"{len(rows)} listings extracted.")
+
+    store = cscrap.PropertyStore.from_frame(
+        cscrap.load_or_initialize_pickle(file_path, sites.COLUMNS, cscrap.STORAGE_BACKEND)
+    )
+    known = len(store)
+    new_properties = store.upsert(rows)
+    logger.info(f"{len(store) - known} listings added to the store, {len(rows)} upserted.")
+    if dry_run:
+        return new_properties
+
+    if cscrap.STORAGE_BACKEND == "sqlite":
+        touched = dict.fromkeys((row["inmobiliaria"], row["ref"]) for row in rows)
+        storage.database(file_path).upsert_listings([store.get(key) for key in touched])
+    else:
+        cscrap.save_to_pickle(store.to_frame(), file_path, cscrap.STORAGE_BACKEND)
+    return new_properties
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--workers", type=int, default=None, help="worker processes (default: one per core)")
+    parser.add_argument("--dry-run", action="store_true", help="extract and merge, but do not save the store")
+    args = parser.parse_args()
+    reextract(args.workers, args.dry_run)
+
+
+if __name__ == "__main__":
+    main()
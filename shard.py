@@ -0,0 +1,216 @@
+"""Sharded crawl: the search matrix of every site as jobs that any number of workers claim.
+
+    python shard.py enqueue                   # queue a run: one job per search of every site
+    python shard.py work [--processes 4]      # claim and run jobs until the run is drained
+    python shard.py reduce                    # merge the shards into the store and new_properties
+    python shard.py run --processes 4         # the three steps on this machine
+
+Search jobs list the result pages of a search and queue a page job for each.
+Page jobs fetch and parse a page; each worker writes the listings of its
+jobs to its own shard files (results/shards/<run_id>/) and only then marks
+the jobs done, so a crashed worker's jobs are claimed again when their lease
+expires (see ctools/jobs.py). Workers on other machines share the queue file
+with --queue. Sharded runs fetch every page: they count as a full sweep.
+"""
+import argparse
+import glob
+import multiprocessing
+import os
+import shutil
+import socket
+import time
+
+import pandas as pd
+
+from ctools import clogger
+from ctools.clogger import logger, frame_summary
+from ctools import cscrap
+from ctools import jobs
+from ctools import listing
+from ctools import metrics
+from ctools import sites
+from ctools import storage
+from ctools import time_lapse
+
+
+properties = 'results/properties.pkl'
+new_properties = 'results/new_properties.pkl'
+SHARDS_DIR = 'results/shards'
+# Page jobs whose listings a worker keeps in memory before writing a shard file
+SHARD_FLUSH_JOBS = 20
+# Seconds a worker waits for leased jobs (which may queue pages) before claiming again
+POLL_SECONDS = 2
+
+
+def enqueue(queue):
+    searches = [
+        (site.name, first_page_url, page_template)
+        for site in sites.all_sites()
+        for first_page_url, page_template in site.searches()
+    ]
+    return queue.create_run(searches)
+
+
+class Shard:
+    """Listings of the page jobs of one worker, written to its own Parquet files."""
+
+    def __init__(self, queue, run_id, worker, directory=SHARDS_DIR):
+        self.queue = queue
+        self.directory = os.path.join(directory, run_id)
+        self.worker = worker
+        self.rows = []
+        self.jobs = []
+        self.files = 0
+
+    def add(self, job, rows):
+        self.rows.extend(rows)
+        self.jobs.append(job)
+        if len(self.jobs) >= SHARD_FLUSH_JOBS:
+            self.flush()
+
+    def flush(self):
+        """Write the buffered listings, then mark their jobs done."""
+        if self.rows:
+            os.makedirs(self.directory, exist_ok=True)
+            path = os.path.join(self.directory, f"{self.worker}-{self.files:04d}.parquet")
+            frame = listing.normalize_prices(pd.DataFrame(self.rows))
+            frame.to_parquet(path, index=False, compression=storage.COMPRESSION)
+            self.files += 1
+            logger.info(f"Shard {path}: {len(self.rows)} listings of {len(self.jobs)} pages.")
+        if self.jobs:
+            self.queue.complete(self.jobs)
+        self.rows, self.jobs = [], []
+
+
+def work(queue_path=jobs.QUEUE_PATH, run_id=None, worker=None, rate=cscrap.HOST_RATE, shards_dir=SHARDS_DIR):
+    """Claim and run jobs of `run_id` (the current run by default) until none is left."""
+    queue = jobs.JobQueue(queue_path)
+    run_id = run_id or queue.current_run()
+    if run_id is None:
+        logger.info("No run to work on: queue one with `python shard.py enqueue`.")
+        return
+    worker = worker or f"{socket.gethostname()}-{os.getpid()}"
+    site_by_name = {site.name: site for site in sites.all_sites()}
+    # Each worker limits the hosts on its own: `rate` is this worker's share
+    throttle = cscrap.HostRateLimiter(rate=rate, bounds=(min(rate, cscrap.HOST_RATE_BOUNDS[0]), rate))
+    fetchers = {}
+    shard = Shard(queue, run_id, worker, shards_dir)
+
+    def fetcher(site):
+        if site.fetcher not in fetchers:
+            fetchers[site.fetcher] = cscrap.get_fetcher(site.fetcher, 1)
+        return fetchers[site.fetcher]
+
+    try:
+        while True:
+            job = queue.claim(run_id, worker)
+            if job is None:
+                # Written listings first: their jobs must not wait for this worker to exit
+                shard.flush()
+                if not queue.leased(run_id):
+                    break
+                time.sleep(POLL_SECONDS)
+                continue
+
+            site = site_by_name[job.site]
+            try:
+                with metrics.site(site.name):
+                    if job.kind == "search":
+                        urls = sites.list_pages(site, fetcher(site), job.search, job.template)
+                        logger.info(f"{site.name}: {len(urls)} pages for {job.search}")
+                        queue.add_pages(job, urls)
+                        continue
+
+                    page_source = cscrap.save_html(fetcher(site), job.url, wait_for=site.wait_for, throttle=throttle)
+                    if page_source is None:
+                        queue.fail(job)
+                        continue
+                    seen = pd.Timestamp.now()
+                    rows = [dict(row, first_seen=seen, last_seen=seen) for row in site.extract(page_source)]
+                    metrics.count("pages")
+                shard.add(job, rows)
+            except Exception as e:
+                logger.error(f"Job {job.job_id} ({job.kind} {job.url or job.search}) failed: {e}")
+                queue.fail(job)
+        shard.flush()
+    finally:
+        for site_fetcher in fetchers.values():
+            site_fetcher.close()
+    logger.info(f"Worker {worker} done: {queue.counts(run_id)}")
+
+
+def work_process(number, queue_path, run_id, rate):
+    """Worker process `number` of work_processes, logging to its own do_scrap.worker-<number>.log."""
+    clogger.log_to(f"{os.path.splitext(clogger.log_file)[0]}.worker-{number}.log")
+    work(queue_path, run_id, rate=rate)
+
+
+def work_processes(processes, queue_path=jobs.QUEUE_PATH, run_id=None, rate=cscrap.HOST_RATE):
+    """Run `processes` local workers; they share `rate` on each host."""
+    if processes <= 1:
+        return work(queue_path, run_id, rate=rate)
+    # Spawned, not forked: each worker starts its own log listener and browsers
+    context = multiprocessing.get_context("spawn")
+    workers = [
+        context.Process(target=work_process, args=(number, queue_path, run_id, rate / processes))
+        for number in range(processes)
+    ]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+
+
+def reduce(queue_path=jobs.QUEUE_PATH, run_id=None, file_path=properties, new_file_path=new_properties, shards_dir=SHARDS_DIR):
+    """Merge every shard of the run into the store and new_properties; returns the new listings."""
+    queue = jobs.JobQueue(queue_path)
+    run_id = run_id or queue.current_run()
+    if run_id is None:
+        logger.info("No run to reduce.")
+        return []
+    counts = queue.counts(run_id)
+    if counts.get(jobs.QUEUED) or queue.leased(run_id):
+        logger.warning(f"Run {run_id} still has jobs to run: {counts}. Reducing what is done.")
+
+    shard_dir = os.path.join(shards_dir, run_id)
+    parts = sorted(glob.glob(os.path.join(shard_dir, "*.parquet")))
+    frame = pd.concat([pd.read_parquet(part) for part in parts], ignore_index=True) if parts else pd.DataFrame()
+    # Oldest pages first, so the latest observation of a listing wins
+    if not frame.empty:
+        frame = frame.sort_values("last_seen", kind="stable")
+    logger.info(frame_summary(frame, name=f"shards of {run_id} ({len(parts)} files)"))
+
+    cscrap.save_to_pickle(pd.DataFrame(columns=sites.COLUMNS), new_file_path)
+    # The shards were fetched before this session: the run starts at their first page, for its price changes
+    started_at = frame["last_seen"].min() if not frame.empty else None
+    with cscrap.PropertySession(file_path, new_file_path, sites.COLUMNS, started_at=started_at) as session:
+        new_listings = session.add(frame) if not frame.empty else []
+    logger.info(f"{len(new_listings)} new listings, {len(session.store)} in the store.")
+
+    queue.mark_reduced(run_id)
+    time_lapse.update_last_full_sweep_date()
+    shutil.rmtree(shard_dir, ignore_errors=True)
+    return new_listings
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("command", choices=["enqueue", "work", "reduce", "run"])
+    parser.add_argument("--queue", default=jobs.QUEUE_PATH, help="job queue file, shared by every worker")
+    parser.add_argument("--run-id", default=None, help="run to work on or reduce (default: the last one not reduced)")
+    parser.add_argument("--processes", type=int, default=1, help="worker processes on this machine")
+    parser.add_argument("--rate", type=float, default=cscrap.HOST_RATE, help="requests/second per host for this machine's workers")
+    args = parser.parse_args()
+
+    run_id = args.run_id
+    if args.command in ("enqueue", "run"):
+        run_id = enqueue(jobs.JobQueue(args.queue))
+    if args.command in ("work", "run"):
+        work_processes(args.processes, args.queue, run_id, args.rate)
+    if args.command in ("reduce", "run"):
+        reduce(args.queue, run_id)
+    metrics.write_summary()
+
+
+if __name__ == "__main__":
+    main()